@@ -1,12 +1,16 @@
 import argparse
-from typing import Union, Set
+import functools
+from typing import FrozenSet, Union
 
 # 許容される真偽値を表す文字列を定数として定義
-TRUE_STRINGS: Set[str] = {"yes", "true", "t", "y", "1"}
-FALSE_STRINGS: Set[str] = {"no", "false", "f", "n", "0"}
-ALL_ACCEPTED_STRINGS: Set[str] = TRUE_STRINGS | FALSE_STRINGS
+TRUE_STRINGS: FrozenSet[str] = frozenset({"yes", "true", "t", "y", "1"})
+FALSE_STRINGS: FrozenSet[str] = frozenset({"no", "false", "f", "n", "0"})
+ALL_ACCEPTED_STRINGS: FrozenSet[str] = TRUE_STRINGS | FALSE_STRINGS
+# エラーメッセージ用の有効な文字列一覧
+_ACCEPTED_STRINGS_MSG: str = ", ".join(sorted(ALL_ACCEPTED_STRINGS))
 
 
+@functools.lru_cache(maxsize=32)
 def str_to_bool(v: Union[str, bool]) -> bool:
     """
     コマンドライン引数として渡された文字列を真偽値に変換する。
@@ -34,6 +38,6 @@ def str_to_bool(v: Union[str, bool]) -> bool:
         # 有効な文字列のリストをエラーメッセージに含める
         error_message: str = (
             f"Boolean value expected, but got '{v}'. "
-            f"Accepted values are: {', '.join(sorted(ALL_ACCEPTED_STRINGS))}"
+            f"Accepted values are: {_ACCEPTED_STRINGS_MSG}"
         )
         raise argparse.ArgumentTypeError(error_message)
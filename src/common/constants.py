@@ -1,45 +1,42 @@
-from enum import Enum, auto
+from enum import IntEnum
 
 
-class BlazePoseLandmark(Enum):
+class BlazePoseLandmark(IntEnum):
     """BlazePoseのランドマークを表すEnum"""
 
-    def _generate_next_value_(name, start, count, last_values):
-        return count  # count は0から始まるので、0,1,2,...となる
-
-    nose = auto()
-    left_eye_inner = auto()
-    left_eye = auto()
-    left_eye_outer = auto()
-    right_eye_inner = auto()
-    right_eye = auto()
-    right_eye_outer = auto()
-    left_ear = auto()
-    right_ear = auto()
-    mouth_left = auto()
-    mouth_right = auto()
-    left_shoulder = auto()
-    right_shoulder = auto()
-    left_elbow = auto()
-    right_elbow = auto()
-    left_wrist = auto()
-    right_wrist = auto()
-    left_pinky = auto()
-    right_pinky = auto()
-    left_index = auto()
-    right_index = auto()
-    left_thumb = auto()
-    right_thumb = auto()
-    left_hip = auto()
-    right_hip = auto()
-    left_knee = auto()
-    right_knee = auto()
-    left_ankle = auto()
-    right_ankle = auto()
-    left_heel = auto()
-    right_heel = auto()
-    left_foot_index = auto()
-    right_foot_index = auto()
+    nose = 0
+    left_eye_inner = 1
+    left_eye = 2
+    left_eye_outer = 3
+    right_eye_inner = 4
+    right_eye = 5
+    right_eye_outer = 6
+    left_ear = 7
+    right_ear = 8
+    mouth_left = 9
+    mouth_right = 10
+    left_shoulder = 11
+    right_shoulder = 12
+    left_elbow = 13
+    right_elbow = 14
+    left_wrist = 15
+    right_wrist = 16
+    left_pinky = 17
+    right_pinky = 18
+    left_index = 19
+    right_index = 20
+    left_thumb = 21
+    right_thumb = 22
+    left_hip = 23
+    right_hip = 24
+    left_knee = 25
+    right_knee = 26
+    left_ankle = 27
+    right_ankle = 28
+    left_heel = 29
+    right_heel = 30
+    left_foot_index = 31
+    right_foot_index = 32
 
 
 assert BlazePoseLandmark.nose.value == 0
@@ -50,29 +47,26 @@ assert (
 )  # Enumのメンバー数が一致することを確認
 
 
-class CocoLandmark(Enum):
+class CocoLandmark(IntEnum):
     """COCO（person keypoints）のランドマークを表すEnum"""
 
-    def _generate_next_value_(name, start, count, last_values):
-        return count  # 0,1,2,...となる
-
-    nose = auto()
-    left_eye = auto()
-    right_eye = auto()
-    left_ear = auto()
-    right_ear = auto()
-    left_shoulder = auto()
-    right_shoulder = auto()
-    left_elbow = auto()
-    right_elbow = auto()
-    left_wrist = auto()
-    right_wrist = auto()
-    left_hip = auto()
-    right_hip = auto()
-    left_knee = auto()
-    right_knee = auto()
-    left_ankle = auto()
-    right_ankle = auto()
+    nose = 0
+    left_eye = 1
+    right_eye = 2
+    left_ear = 3
+    right_ear = 4
+    left_shoulder = 5
+    right_shoulder = 6
+    left_elbow = 7
+    right_elbow = 8
+    left_wrist = 9
+    right_wrist = 10
+    left_hip = 11
+    right_hip = 12
+    left_knee = 13
+    right_knee = 14
+    left_ankle = 15
+    right_ankle = 16
 
 
 assert CocoLandmark.nose.value == 0
@@ -82,39 +76,52 @@ assert len(CocoLandmark) == COCO_LANDMARK_LEN  # Enumのメンバー数が一致
 
 
 # BlazePose → COCO の変換辞書
+# (COCOの17点はBlazePoseに同名のランドマークが存在する)
 BLAZEPOSE_TO_COCO = {
-    BlazePoseLandmark.nose: CocoLandmark.nose,
-    BlazePoseLandmark.left_eye: CocoLandmark.left_eye,
-    BlazePoseLandmark.right_eye: CocoLandmark.right_eye,
-    BlazePoseLandmark.left_ear: CocoLandmark.left_ear,
-    BlazePoseLandmark.right_ear: CocoLandmark.right_ear,
-    BlazePoseLandmark.left_shoulder: CocoLandmark.left_shoulder,
-    BlazePoseLandmark.right_shoulder: CocoLandmark.right_shoulder,
-    BlazePoseLandmark.left_elbow: CocoLandmark.left_elbow,
-    BlazePoseLandmark.right_elbow: CocoLandmark.right_elbow,
-    BlazePoseLandmark.left_wrist: CocoLandmark.left_wrist,
-    BlazePoseLandmark.right_wrist: CocoLandmark.right_wrist,
-    BlazePoseLandmark.left_hip: CocoLandmark.left_hip,
-    BlazePoseLandmark.right_hip: CocoLandmark.right_hip,
-    BlazePoseLandmark.left_knee: CocoLandmark.left_knee,
-    BlazePoseLandmark.right_knee: CocoLandmark.right_knee,
-    BlazePoseLandmark.left_ankle: CocoLandmark.left_ankle,
-    BlazePoseLandmark.right_ankle: CocoLandmark.right_ankle,
+    BlazePoseLandmark[n]: c for n, c in CocoLandmark.__members__.items()
 }
 
 # COCO → BlazePose の変換辞書
 COCO_TO_BLAZEPOSE = {v: k for k, v in BLAZEPOSE_TO_COCO.items()}
 
 
+def _build_index_table(mapping: dict, length: int) -> tuple[int, ...]:
+    """変換辞書をインデックス直引き用のテーブルに展開 (対応なしは-1)"""
+    table = [-1] * length
+    for src, dst in mapping.items():
+        table[src] = int(dst)
+    return tuple(table)
+
+
+# BlazePoseインデックス → COCOインデックス の変換テーブル
+BLAZEPOSE_TO_COCO_INDEX: tuple[int, ...] = _build_index_table(
+    BLAZEPOSE_TO_COCO, BLAZEPOSE_LANDMARK_LEN
+)
+# COCOインデックス → BlazePoseインデックス の変換テーブル
+COCO_TO_BLAZEPOSE_INDEX: tuple[int, ...] = _build_index_table(
+    COCO_TO_BLAZEPOSE, COCO_LANDMARK_LEN
+)
+
+
+# BlazePose → COCO (インデックス)
+def blazepose_to_coco_int(index: int) -> int:
+    coco_index = BLAZEPOSE_TO_COCO_INDEX[index]
+    if coco_index < 0:
+        raise ValueError(f"対応するCOCOランドマークが存在しません: {index}")
+    return coco_index
+
+
+# COCO → BlazePose (インデックス)
+def coco_to_blazepose_int(index: int) -> int:
+    # COCOは全点がBlazePoseに対応している
+    return COCO_TO_BLAZEPOSE_INDEX[index]
+
+
 # BlazePose → COCO
 def blazepose_to_coco(landmark: BlazePoseLandmark) -> CocoLandmark:
-    if landmark not in BLAZEPOSE_TO_COCO:
-        raise ValueError(f"対応するCOCOランドマークが存在しません: {landmark}")
-    return BLAZEPOSE_TO_COCO[landmark]
+    return CocoLandmark(blazepose_to_coco_int(landmark))
 
 
 # COCO → BlazePose
 def coco_to_blazepose(landmark: CocoLandmark) -> BlazePoseLandmark:
-    if landmark not in COCO_TO_BLAZEPOSE:
-        raise ValueError(f"対応するBlazePoseランドマークが存在しません: {landmark}")
-    return COCO_TO_BLAZEPOSE[landmark]
+    return BlazePoseLandmark(coco_to_blazepose_int(landmark))
@@ -12,12 +12,12 @@ def divide_to_tuple(tags: list[str]) -> list[tuple[str, str]]:
     """
     parsed_tags: list[tuple[str, str]] = []
     for tag_str in tags:
-        if "=" in tag_str:
-            # (valueがスペースを含んでいる場合でも動く筈)
-            key, value = tag_str.split("=", 1)
+        # (valueがスペースや"="を含んでいる場合でも動く筈)
+        key, sep, value = tag_str.partition("=")
+        if sep:
             parsed_tags.append((key, value))
         else:
             L.warning(
-                f"Skipping malformed tag: {tag_str}. Expected format 'key=value'."
+                "Skipping malformed tag: %s. Expected format 'key=value'.", tag_str
             )
     return parsed_tags
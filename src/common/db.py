@@ -1,6 +1,9 @@
+import hashlib
+import logging as L
 import sqlite3
+from contextlib import closing, contextmanager
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional, Sequence
 
 from common import sql
 from common.table_check import check_validity
@@ -18,6 +21,15 @@ class Db:
         """
         assert False, "This method must be implemented"
 
+    @property
+    def index_query(self) -> str:
+        """
+        インデックス作成クエリを返す(CREATE INDEX IF NOT EXISTS で記述すること)
+        スキーマのフィンガープリントには含めないので、既存データを保持したまま後から追加できる
+        サブクラスで必要に応じてオーバーライドする
+        """
+        return ""
+
     @property
     def table_def(self) -> TableDef:
         """
@@ -30,9 +42,30 @@ class Db:
     _db_path: str
     _clear_table: bool
     _row_name: bool
+    _tune_pragmas: bool
+    _autocommit: bool
+    _durable: bool
+    _savepoint_depth: int
     conn: Optional[sqlite3.Connection]
 
-    def __init__(self, dbpath: str, clear_table: bool, row_name: bool = False):
+    # sqlite3が保持するプリペアドステートメントのキャッシュ数
+    CACHED_STATEMENTS: int = 512
+    # autocommitでない場合にトランザクションを開始する文
+    # (書き込み専用のDbでは "BEGIN IMMEDIATE" にして、書き込みロックを先に取得する)
+    BEGIN_STATEMENT: str = "BEGIN"
+    # フィンガープリント未登録のデータベースでテーブル定義が食い違っていた場合に作り直すか
+    # (他のテーブルから再計算できる派生テーブルのみを持つDbでTrueにする)
+    REBUILD_ON_SCHEMA_MISMATCH: bool = False
+
+    def __init__(
+        self,
+        dbpath: str,
+        clear_table: bool,
+        row_name: bool = False,
+        tune_pragmas: bool = True,
+        autocommit: bool = False,
+        durable: bool = False,
+    ):
         """
         Dbクラスのコンストラクタ
 
@@ -41,10 +74,22 @@ class Db:
             clear_table (bool): Trueの場合、既存のデータベースファイルがあっても新しく作り直す
             row_name (bool): Trueの場合、結果セットのカラムに名前でアクセス可能にする
                                        デフォルトはFalse
+            tune_pragmas (bool): Trueの場合、WAL等の書き込み高速化用PRAGMAを設定する
+                                       デフォルトはTrue
+            autocommit (bool): Trueの場合、文ごとに自動コミットする
+                                       Falseの場合は明示的なトランザクション内で書き込み、
+                                       commit()または終了時にまとめてコミットする
+                                       デフォルトはFalse
+            durable (bool): Trueの場合、tune_pragmasでもコミット毎にfsyncする(synchronous=FULL)
+                                       デフォルトはFalse
         """
         self._db_path = dbpath
         self._clear_table = clear_table
         self._row_name = row_name
+        self._tune_pragmas = tune_pragmas
+        self._autocommit = autocommit
+        self._durable = durable
+        self._savepoint_depth = 0
         self.conn = None
 
     def post_conn_created(self) -> None:
@@ -54,6 +99,14 @@ class Db:
         """
         pass
 
+    def load_extensions(self, conn: sqlite3.Connection) -> None:
+        """
+        接続に必要なSQLite拡張をロードする
+        (スキーマ照合用の一時データベースにも適用される)
+        サブクラスで必要に応じてオーバーライドする
+        """
+        pass
+
     def post_table_initialized(self) -> None:
         """
         テーブルの初期化(作成またはクリア後)が完了した後に実行されるメソッド
@@ -67,36 +120,125 @@ class Db:
         データベース接続を確立し、テーブルの初期化または検証を行う
         """
         file_exists: bool = Path(self._db_path).exists()
-        self.conn = conn = sqlite3.connect(self._db_path)
+        # トランザクションは自前で管理する(isolation_level=None)
+        self.conn = conn = sqlite3.connect(
+            self._db_path,
+            cached_statements=self.CACHED_STATEMENTS,
+            isolation_level=None,
+        )
         if self._row_name:
             # row_factoryを設定することで、結果セットのカラムに名前でアクセスできるようになる
             self.conn.row_factory = sqlite3.Row
         self.post_conn_created()
 
         cur = conn.cursor()
+        if self._tune_pragmas:
+            if not sql.ApplyPerformancePragmas(cur, self._durable):
+                L.warning(f"WAL mode is not available for {self._db_path}")
         tdef = self.table_def
+        # スキーマのフィンガープリント
+        # (記録されるテーブル定義を正規化したものから求めるので、コメントや空白の変更は含まない)
+        schema_key = ",".join(tdef.keys())
+        expected_sql = self._expected_table_sql()
+        fingerprint = hashlib.sha1(
+            "\n".join(f"{t}:{expected_sql[t] or ''}" for t in tdef).encode("utf-8")
+        ).hexdigest()
+        sql.CreateSchemaMetaIfNotExists(cur)
         # データベースが初期化済みか、またはテーブルをクリアする場合
         should_initialized: bool = not file_exists or self._clear_table
+        stored_fingerprint = (
+            None if should_initialized else sql.GetSchemaFingerprint(cur, schema_key)
+        )
+        adopt_fingerprint: bool = True
         if should_initialized:
             # テーブルの初期化(既存テーブルがあれば削除し、再作成)
-            sql.DropTableIfExists(cur, tdef.keys())
-            sql.Execute(cur, self.init_query)
-            self.post_table_initialized()
+            self._initialize_tables(cur)
         else:
             # 既存データベースの場合はテーブルの正当性をチェックする(Pre-check)
+            # (スキーマが一致していればDDLは発行しない)
             try:
                 check_validity(conn, tdef)
             except VCFTableNotFound:
                 # 一部のテーブルだけ先に作成されていた場合などを考慮し、
                 # テーブル定義と一致しない場合は再初期化する
-                sql.DropTableIfExists(cur, tdef.keys())
-                sql.Execute(cur, self.init_query)
-                self.post_table_initialized()
+                self._initialize_tables(cur)
+            else:
+                if stored_fingerprint != fingerprint:
+                    # フィンガープリントが未登録(導入前に作成された)か、定義が変わっている場合は
+                    # 実際のテーブル定義と照合し、一致する場合のみ現行のスキーマとみなす
+                    # (check_validityはvec0等のカラムを確認しないため)
+                    mismatched = self._mismatched_tables(cur, expected_sql)
+                    if mismatched and self.REBUILD_ON_SCHEMA_MISMATCH:
+                        L.warning(
+                            f"Schema of {', '.join(mismatched)} differs"
+                            " from the current definition. Re-initializing tables"
+                        )
+                        self._initialize_tables(cur)
+                    elif mismatched:
+                        # 再計算できないデータを消さないよう、テーブルは作り直さない
+                        # (後からスキーマの変更を検出できるよう、フィンガープリントも保存しない)
+                        L.warning(
+                            f"Schema of {', '.join(mismatched)} differs"
+                            " from the current definition. Tables are kept as they are;"
+                            " run with --init_db to re-create them"
+                        )
+                        adopt_fingerprint = False
+        if adopt_fingerprint and stored_fingerprint != fingerprint:
+            sql.SetSchemaFingerprint(cur, schema_key, fingerprint)
+        if self.index_query:
+            # 既存のデータベースにも不足しているインデックスを追加する
+            sql.Execute(cur, self.index_query)
 
-        # 外部キー制約を有効にする
+        # 外部キー制約を有効にする(トランザクション外で設定する必要がある)
         sql.EnableForeignKeys(cur)
+        if not self._autocommit:
+            # 以降の書き込みは1つのトランザクションにまとめる
+            cur.execute(self.BEGIN_STATEMENT)
         return self
 
+    def _expected_table_sql(self) -> dict[str, Optional[str]]:
+        """
+        init_queryで作成されるテーブル毎の定義(正規化したSQL文)を返す
+        (init_queryを一時的なインメモリデータベースで実行し、sqlite_masterに記録された文を使う)
+        """
+        with closing(sqlite3.connect(":memory:")) as expected:
+            self.load_extensions(expected)
+            expected_cur = expected.cursor()
+            sql.Execute(expected_cur, self.init_query)
+            result: dict[str, Optional[str]] = {}
+            for table in self.table_def:
+                table_sql = sql.GetTableSql(expected_cur, table)
+                result[table] = (
+                    None if table_sql is None else sql.NormalizeSql(table_sql)
+                )
+            return result
+
+    def _mismatched_tables(
+        self, cur: sqlite3.Cursor, expected_sql: dict[str, Optional[str]]
+    ) -> list[str]:
+        """
+        既存テーブルの作成時のSQL文をexpected_sqlと照合し、食い違っているテーブル名を返す
+        """
+        mismatched: list[str] = []
+        for table, expected in expected_sql.items():
+            actual = sql.GetTableSql(cur, table)
+            if (
+                actual is None
+                or expected is None
+                or sql.NormalizeSql(actual) != expected
+            ):
+                mismatched.append(table)
+        return mismatched
+
+    def _initialize_tables(self, cur: sqlite3.Cursor) -> None:
+        """
+        テーブルを削除・再作成し、初期化後の処理をトランザクション内で実行する
+        """
+        sql.DropTableIfExists(cur, self.table_def.keys())
+        sql.Execute(cur, self.init_query)
+        with self.transaction():
+            self.post_table_initialized()
+
     def __exit__(
         self,
         e_type: Optional[type],
@@ -131,8 +273,73 @@ class Db:
     def commit(self) -> None:
         """
         現在のトランザクションの変更をコミットする
+        autocommitでない場合は、続けて新しいトランザクションを開始する
         """
         if self.conn is not None:
             self.conn.commit()
+            if not self._autocommit:
+                self.conn.execute(self.BEGIN_STATEMENT)
         else:
             raise RuntimeError("Database connection is not established.")
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        SAVEPOINTを使ったトランザクションスコープ
+        外側のトランザクションを壊さずに入れ子にでき、例外時はこのスコープ内の変更のみ取り消す
+        """
+        if self.conn is None:
+            raise RuntimeError("Database connection is not established.")
+        name = f"sp{self._savepoint_depth}"
+        self._savepoint_depth += 1
+        self.conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute(f"ROLLBACK TO {name}")
+            self.conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            self.conn.execute(f"RELEASE {name}")
+        finally:
+            self._savepoint_depth -= 1
+
+    def bulk_upsert(
+        self,
+        table: str,
+        cols: Sequence[str],
+        rows: Iterable[Sequence[Any]],
+        conflict_cols: Sequence[str],
+    ) -> None:
+        """
+        executemanyで複数行をまとめてUPSERTする
+
+        Args:
+            table (str): 書き込み先のテーブル名(table_defに含まれている必要がある)
+            cols (Sequence[str]): 書き込むカラム名
+            rows (Iterable[Sequence[Any]]): colsの順に並んだ値の列
+            conflict_cols (Sequence[str]): 一意制約となるカラム名(colsに含まれる)
+        """
+        self._check_identifiers(table, [*cols, *conflict_cols])
+        placeholders = ",".join("?" * len(cols))
+        updates = ",".join(f"{c}=excluded.{c}" for c in cols if c not in conflict_cols)
+        conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        query = (
+            f"INSERT INTO {table}({','.join(cols)}) VALUES({placeholders})"
+            f" ON CONFLICT({','.join(conflict_cols)}) {conflict_action}"
+        )
+        with self.transaction(), closing(self.cursor()) as cur:
+            cur.executemany(query, rows)
+
+    def _check_identifiers(self, table: str, cols: Sequence[str]) -> None:
+        """
+        SQLに埋め込むテーブル名・カラム名がテーブル定義に含まれているか確認する
+        """
+        if table not in self.table_def:
+            raise ValueError(f"Unknown table: {table}")
+        column_types = self.table_def[table]
+        for c in cols:
+            # カラム定義が無いテーブル(vec0等)は識別子として妥当かのみ確認
+            valid = c.isidentifier() if column_types is None else c in column_types
+            if not valid:
+                raise ValueError(f"Unknown column for {table}: {c}")
@@ -1,11 +1,12 @@
 import argparse
-import math
+import functools
 from contextlib import suppress
 from pathlib import Path
 
 from common.argparse_aux import str_to_bool
 from common.default_path import DEFAULT_DB_PATH
 from common.log import add_logging_args
+from common.sql import HasTable
 
 
 def add_optional_arguments_to_parser(parser: argparse.ArgumentParser) -> None:
@@ -25,57 +26,70 @@ def add_optional_arguments_to_parser(parser: argparse.ArgumentParser) -> None:
     add_logging_args(parser)
 
 
-def calc_landmark_dir(
-    cur, input_index: tuple[tuple[int, int], tuple[int, int]], result_table: str
-) -> None:
-    # PoseId列挙
-    cur.execute("SELECT id FROM Pose")
-    pose_ids = [row[0] for row in cur.fetchall()]
+# calc_landmark_dir の結果を書き込めるテーブル (f-stringでSQLに埋め込むため限定する)
+LANDMARK_DIR_TABLES: frozenset[str] = frozenset({"MasseThighDir", "MasseCrusDir"})
+# calc_landmark_dir の結果から未計算のポーズのみ(差分)を計算するテーブル
+# (方向が書き換わったポーズの行は削除し、次回の計算対象に戻す)
+LANDMARK_DIR_DEPENDENTS: tuple[str, ...] = ("CrusFlexion",)
 
-    for pose_id in pose_ids:
-        for is_right, (APos_idx, BPos_idx) in enumerate(input_index):
-            # APos, BPos の座標を取得
-            cur.execute(
-                """
-                SELECT x, y, z FROM Landmark
-                WHERE poseId = ? AND landmarkIndex = ?
-            """,
-                (pose_id, APos_idx),
-            )
-            APos_row = cur.fetchone()
-
-            cur.execute(
-                """
-                SELECT x, y, z FROM Landmark
-                WHERE poseId = ? AND landmarkIndex = ?
-            """,
-                (pose_id, BPos_idx),
-            )
-            BPos_row = cur.fetchone()
 
-            if not APos_row or not BPos_row:
-                continue  # データ不足
-
-            # ベクトル計算 (BPos - APos)
-            vx = BPos_row[0] - APos_row[0]
-            vy = BPos_row[1] - APos_row[1]
-            vz = BPos_row[2] - APos_row[2]
+@functools.lru_cache(maxsize=None)
+def _landmark_dir_sql(result_table: str, num_sides: int) -> str:
+    """
+    (APos, BPos)のランドマーク対から方向ベクトルを算出し、
+    結果テーブルへUPSERTするクエリ(キャッシュ)
+    """
+    if result_table not in LANDMARK_DIR_TABLES:
+        raise ValueError(f"Unsupported result table: {result_table}")
+    sides = ",".join(f"({i}, ?, ?)" for i in range(num_sides))
+    return f"""
+        WITH Side(is_right, a_idx, b_idx) AS (VALUES {sides}),
+        -- APos, BPos の両方が揃っているポーズのみ対象 (データ不足は除外)
+        Vec AS (
+            SELECT
+                a.poseId,
+                Side.is_right,
+                -- ベクトル計算 (BPos - APos)
+                b.x - a.x AS vx,
+                b.y - a.y AS vy,
+                b.z - a.z AS vz
+            FROM Side
+            JOIN Landmark AS a
+                ON a.landmarkIndex = Side.a_idx
+            JOIN Landmark AS b
+                ON b.poseId = a.poseId AND b.landmarkIndex = Side.b_idx
+        ),
+        VecLen AS (
+            SELECT poseId, is_right, vx, vy, vz, sqrt(vx*vx + vy*vy + vz*vz) AS len
+            FROM Vec
+        )
+        INSERT INTO {result_table} (poseId, is_right, x, y, z)
+        -- 正規化
+        SELECT poseId, is_right, vx / len, vy / len, vz / len
+        FROM VecLen
+        WHERE len > 0
+        ON CONFLICT(poseId, is_right) DO UPDATE
+        SET x=excluded.x, y=excluded.y, z=excluded.z
+        -- 値が変わらない行は書き換えない (RETURNINGにも含めない)
+        WHERE x IS NOT excluded.x OR y IS NOT excluded.y OR z IS NOT excluded.z
+        RETURNING poseId, is_right
+        """
 
-            # 正規化
-            length = math.sqrt(vx * vx + vy * vy + vz * vz)
-            if length == 0:
-                continue
-            vx /= length
-            vy /= length
-            vz /= length
 
-            # ResultTable に保存（UPSERT）
-            cur.execute(
-                f"""
-                INSERT INTO {result_table} (poseId, is_right, x, y, z)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(poseId, is_right) DO UPDATE
-                SET x=excluded.x, y=excluded.y, z=excluded.z
-                """,
-                (pose_id, is_right, vx, vy, vz),
+def calc_landmark_dir(
+    cur, input_index: tuple[tuple[int, int], tuple[int, int]], result_table: str
+) -> None:
+    # 取得・計算・保存(UPSERT)までをSQLite内で一括実行する
+    changed = cur.execute(
+        _landmark_dir_sql(result_table, len(input_index)),
+        [idx for pair in input_index for idx in pair],
+    ).fetchall()
+    if not changed:
+        return
+    # 追加・更新された方向に依存する計算済みの行を削除する
+    for table in LANDMARK_DIR_DEPENDENTS:
+        if HasTable(cur, table):
+            cur.executemany(
+                f"DELETE FROM {table} WHERE poseId = ? AND is_right = ?",
+                (tuple(row) for row in changed),
             )
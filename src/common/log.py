@@ -1,16 +1,6 @@
 import argparse
 import logging
 from contextlib import suppress
-from typing import Dict
-
-# ログレベル名から数値へのマッピング
-NUM_TO_LOGLEVEL: Dict[str, int] = {
-    "critical": logging.CRITICAL,
-    "error": logging.ERROR,
-    "warning": logging.WARNING,
-    "info": logging.INFO,
-    "debug": logging.DEBUG,
-}
 
 
 def add_logging_args(parser: argparse.ArgumentParser) -> None:
@@ -37,19 +27,16 @@ def apply_logging_option(args: argparse.Namespace) -> None:
         args (argparse.Namespace): コマンドライン引数を格納したオブジェクト
                                    'log_level' 属性を持つことを想定
     """
-    # 指定されたログレベル文字列を小文字に変換し、対応する数値ログレベルを取得
-    # 取得したログレベルで基本的なロギング設定を行う
-    log_level_str: str = args.log_level.lower()
+    # 指定されたログレベル文字列を大文字に変換し、対応する数値ログレベルを取得
+    # (未知の名前の場合は "Level XX" という文字列が返る)
+    level_to_apply = logging.getLevelName(args.log_level.upper())
 
-    # ログレベル文字列が NUM_TO_LOGLEVEL に存在するかチェック
-    if log_level_str not in NUM_TO_LOGLEVEL:
+    if not isinstance(level_to_apply, int):
         # 存在しない場合は、デフォルトのWARNINGレベルを使用
         print(
-            f"Error: Invalid log level '{args.log_level}'. Accepted values are: {', '.join(NUM_TO_LOGLEVEL.keys())}"
+            f"Error: Invalid log level '{args.log_level}'. Accepted values are: {', '.join(logging.getLevelNamesMapping())}"
         )
         level_to_apply = logging.WARNING
-    else:
-        level_to_apply: int = NUM_TO_LOGLEVEL[log_level_str]
 
     logging.basicConfig(
         format="%(levelname)s:%(message)s",  # ログメッセージのフォーマットを指定
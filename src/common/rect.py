@@ -6,6 +6,8 @@ class Rect2D:
     2次元矩形を表現するクラス
     """
 
+    __slots__ = ("x_min", "y_min", "x_max", "y_max")
+
     def __init__(self, x_min: float, y_min: float, x_max: float, y_max: float) -> None:
         """
         @brief コンストラクタ
@@ -15,11 +17,29 @@ class Rect2D:
         @param y_max 最大y座標
         @exception ValueError 無効な座標が指定された場合の例外
         """
+        if x_min > x_max or y_min > y_max:
+            raise ValueError(
+                "Invalid rectangle coordinates: min must be less than or equal to max"
+            )
         self.x_min = x_min
         self.y_min = y_min
         self.x_max = x_max
         self.y_max = y_max
-        self._validate()
+
+    @classmethod
+    def _unchecked(
+        cls, x_min: float, y_min: float, x_max: float, y_max: float
+    ) -> Rect2D:
+        """
+        @brief 妥当性検証を省略したインスタンス生成
+        @note 呼び出し側で min <= max が保証されている場合のみ使用する
+        """
+        r = cls.__new__(cls)
+        r.x_min = x_min
+        r.y_min = y_min
+        r.x_max = x_max
+        r.y_max = y_max
+        return r
 
     def is_valid(self) -> bool:
         """
@@ -28,16 +48,6 @@ class Rect2D:
         """
         return self.x_min <= self.x_max and self.y_min <= self.y_max
 
-    def _validate(self) -> None:
-        """
-        @brief 矩形座標の妥当性検証
-        @exception ValueError 無効な座標が指定された場合の例外
-        """
-        if not self.is_valid():
-            raise ValueError(
-                "Invalid rectangle coordinates: min must be less than or equal to max"
-            )
-
     @property
     def width(self) -> float:
         """
@@ -89,7 +99,8 @@ class Rect2D:
         """
         if left < 0 or right < 0 or top < 0 or bottom < 0:
             raise ValueError("Margins must be non-negative")
-        return Rect2D(
+        # 有効な矩形を非負のマージンで広げるので検証は不要
+        return Rect2D._unchecked(
             self.x_min - left,
             self.y_min - bottom,
             self.x_max + right,
@@ -1,11 +1,22 @@
+import functools
 import struct
 
+import numpy as np
+
+
+@functools.lru_cache(maxsize=128)
+def _float_struct(num_elements: int) -> struct.Struct:
+    """
+    要素数に対応するfloat配列用のStructを生成(キャッシュ)
+    """
+    return struct.Struct(f"{num_elements}f")
+
 
 def vec_serialize(vector: list[float]) -> bytes:
     """
     floatのリストをコンパクトなbytes形式にシリアライズ
     """
-    return struct.pack("%sf" % len(vector), *vector)
+    return _float_struct(len(vector)).pack(*vector)
 
 
 def vec_deserialize(vector_bytes: bytes) -> list[float]:
@@ -17,26 +28,45 @@ def vec_deserialize(vector_bytes: bytes) -> list[float]:
     # floatのサイズは通常4バイトなので、要素数を計算
     num_elements: int = byte_length // 4
     # バイト列をfloatのリストにアンパック
-    return list(struct.unpack("%sf" % num_elements, vector_bytes))
+    return list(_float_struct(num_elements).unpack(vector_bytes))
+
+
+# int8量子化のスケール ([-1, 1] → [-127, 127])
+INT8_SCALE: int = 127
+
+
+@functools.lru_cache(maxsize=128)
+def _int8_struct(num_elements: int) -> struct.Struct:
+    """
+    要素数に対応するint8配列用のStructを生成(キャッシュ)
+    """
+    return struct.Struct(f"{num_elements}b")
 
 
-# pythonコマンドから呼び出された時のみ実行
-if __name__ == "__main__":
+def vec_serialize_int8(vector: list[float]) -> bytes:
+    """
+    [-1, 1]の範囲のfloatのリストをint8に量子化してシリアライズ
+    (vec0の int8[N] カラムに vec_int8(?) で書き込む用)
+    """
+    return _int8_struct(len(vector)).pack(
+        *(max(-INT8_SCALE, min(INT8_SCALE, round(v * INT8_SCALE))) for v in vector)
+    )
 
-    def test_vec_serialize_deserialize():
-        """
-        vec_serializeとvec_deserializeのテスト
-        """
-        test_vector = [1.0, 2.5, -3.14, 0.0, 100.5]
-        serialized_vector = vec_serialize(test_vector)
-        deserialized_vector = vec_deserialize(serialized_vector)
 
-        # 元のベクトルとデシリアライズされたベクトルが(ほぼ)一致するか確認
-        assert all(
-            abs(a - b) < 1e-6
-            for a, b in zip(test_vector, deserialized_vector)
-        ), "Serialization/Deserialization failed!"
-        print("vec_serialize and vec_deserialize tests passed.")
+def vec_serialize_int8_rows(vectors: np.ndarray) -> list[bytes]:
+    """
+    (行数, 次元数)の配列の各行をvec_serialize_int8と同じ形式に量子化してシリアライズ
+    (行毎にリストを作ってpackせず、配列全体をまとめて量子化する)
+    """
+    # roundと同じく偶数丸め(np.rint)
+    quantized = np.clip(np.rint(vectors * INT8_SCALE), -INT8_SCALE, INT8_SCALE)
+    return [row.tobytes() for row in quantized.astype(np.int8)]
+
 
-    # テストを実行
-    test_vec_serialize_deserialize()
+def vec_deserialize_int8(vector_bytes: bytes) -> list[float]:
+    """
+    int8に量子化されたバイト列からfloatのリスト(ベクトル)を復元
+    """
+    return [
+        v / INT8_SCALE for v in _int8_struct(len(vector_bytes)).unpack(vector_bytes)
+    ]
@@ -1,3 +1,4 @@
+import re
 import sqlite3
 
 
@@ -6,6 +7,30 @@ def EnableForeignKeys(cur: sqlite3.Cursor) -> None:
     cur.execute("PRAGMA foreign_keys = ON")
 
 
+def ApplyPerformancePragmas(cur: sqlite3.Cursor, durable: bool = False) -> bool:
+    """
+    書き込みスループット向上のためのPRAGMAを設定
+    durable=True の場合はコミット毎にfsyncする(synchronous=FULL)
+    WALモードに切り替えられた場合はTrueを返す
+    """
+    # WAL + NORMAL でコミット毎のfsyncを削減
+    journal_mode: str = cur.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    is_wal = journal_mode.lower() == "wal"
+    # WALでない場合(ネットワークドライブ等)、NORMALでは電源断時に破損し得るのでFULLにする
+    synchronous = "NORMAL" if is_wal and not durable else "FULL"
+    cur.execute(f"PRAGMA synchronous = {synchronous}")
+    if is_wal:
+        # チェックポイントの間隔を広げ、大量挿入中のWAL書き戻し回数を減らす (10000ページ)
+        cur.execute("PRAGMA wal_autocheckpoint = 10000")
+    # 一時データはメモリ上に置く
+    cur.execute("PRAGMA temp_store = MEMORY")
+    # 256MBまでメモリマップで読み込む
+    cur.execute("PRAGMA mmap_size = 268435456")
+    # ページキャッシュを64MBに拡大 (負の値はKiB単位)
+    cur.execute("PRAGMA cache_size = -65536")
+    return is_wal
+
+
 def HasTable(cursor: sqlite3.Cursor, table_name: str) -> bool:
     """指定されたテーブルが存在するかどうかを確認"""
     # sqlite_masterテーブルをクエリして、指定された名前(大文字小文字を区別しない)のテーブルが存在するかを確認
@@ -20,6 +45,52 @@ def HasTable(cursor: sqlite3.Cursor, table_name: str) -> bool:
     return ret.fetchone()[0] > 0
 
 
+def GetTableSql(cursor: sqlite3.Cursor, table_name: str) -> str | None:
+    """指定されたテーブルの作成時のSQL文を取得(存在しない場合はNone)"""
+    row = cursor.execute(
+        """
+            SELECT sql FROM sqlite_master
+                WHERE type='table' AND LOWER(name)=?
+        """,
+        (table_name.lower(),),
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def NormalizeSql(query: str) -> str:
+    """比較用に、SQL文からコメントを取り除いて空白を詰める"""
+    return " ".join(re.sub(r"--[^\n]*", "", query).split())
+
+
+# 各テーブル群のスキーマのフィンガープリントを保持するテーブル
+SCHEMA_META_TABLE = "_schema_meta"
+
+
+def CreateSchemaMetaIfNotExists(cur: sqlite3.Cursor) -> None:
+    """スキーマのフィンガープリント管理用テーブルを作成"""
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_META_TABLE}(k TEXT PRIMARY KEY, v TEXT)"
+    )
+
+
+def GetSchemaFingerprint(cur: sqlite3.Cursor, key: str) -> str | None:
+    """保存されているスキーマのフィンガープリントを取得(未登録ならNone)"""
+    ret = cur.execute(f"SELECT v FROM {SCHEMA_META_TABLE} WHERE k=?", (key,))
+    row = ret.fetchone()
+    return None if row is None else row[0]
+
+
+def SetSchemaFingerprint(cur: sqlite3.Cursor, key: str, value: str) -> None:
+    """スキーマのフィンガープリントを保存"""
+    cur.execute(
+        f"""
+            INSERT INTO {SCHEMA_META_TABLE}(k, v) VALUES (?, ?)
+                ON CONFLICT(k) DO UPDATE SET v=excluded.v
+        """,
+        (key, value),
+    )
+
+
 def DropTableIfExists(cursor: sqlite3.Cursor, table: str | list[str]) -> bool:
     """指定されたテーブルが存在する場合に削除"""
     # 引数が単一のテーブル名(文字列)の場合
@@ -41,9 +112,7 @@ def DropTableIfExists(cursor: sqlite3.Cursor, table: str | list[str]) -> bool:
 def Execute(cur: sqlite3.Cursor, query_string: str) -> None:
     """
     複数文の実行に対応
-    クエリ文字列をセミコロンで分割し、各部分を個別に実行
+    SQLite側のパーサで全文をまとめて実行する
+    (executescriptは実行前に未コミットのトランザクションをコミットする点に注意)
     """
-    for q in query_string.split(";"):
-        # 空の文字列(最後のセミコロンの後など)はスキップ
-        if q.strip():
-            cur.execute(q)
+    cur.executescript(query_string)
@@ -6,19 +6,28 @@ import sqlite3
 from common import sql
 from common.table_check_exception import (
     VCFColumnMismatch,
-    VCFInvalidRow,
+    VCFColumnTypeMismatch,
     VCFTableNotFound,
 )
 from common.types import TableDef
 
+# 宣言型からPythonの型への対応
+DECLTYPE_TO_TYPE: dict[str, type] = {
+    "INTEGER": int,
+    "REAL": float,
+    "TEXT": str,
+    "BLOB": bytes,
+}
+
 
 # テーブルが存在するか、カラムの型が合っているかのチェック
 def check_validity(
         conn: sqlite3.Connection,
         table_def: TableDef
 ):
-    conn.row_factory = sqlite3.Row
+    # 呼び出し元のrow_factoryを変更しないよう、チェック用のカーソルのみタプルで受け取る
     cur = conn.cursor()
+    cur.row_factory = None
     for table_name, column_types in table_def.items():
         # テーブルの存在確認
         if not sql.HasTable(cur, table_name):
@@ -26,9 +35,12 @@ def check_validity(
 
         if column_types is None:
             continue
-        cur.execute(f"SELECT * FROM {table_name}")
+        # 行データを読まずにスキーマ情報だけを取得する
+        # (cid, name, type, notnull, dflt_value, pk)
+        cur.execute(f"PRAGMA table_info({table_name})")
+        columns = cur.fetchall()
         # カラム名(数)のチェック
-        actual_cname = [tup[0] for tup in cur.description]
+        actual_cname = [col[1] for col in columns]
         err = False
         if (len(actual_cname) != len(column_types)):
             err = True
@@ -44,17 +56,14 @@ def check_validity(
                 actual_cname
             )
 
-        # 値の型チェック
-        res = cur.fetchall()
-        for row in res:
-            err = False
-            for i, val in enumerate(row):
-                if column_types[actual_cname[i]] is not type(val):
-                    err = True
-                    break
-            if err:
-                raise VCFInvalidRow(
+        # 宣言型のチェック
+        actual_types = {
+            col[1]: DECLTYPE_TO_TYPE.get(col[2].upper()) for col in columns
+        }
+        for cname, ctype in actual_types.items():
+            if column_types[cname] is not ctype:
+                raise VCFColumnTypeMismatch(
                     table_name,
                     column_types,
-                    {actual_cname[i]: val for i, val in enumerate(row)}
+                    actual_types
                 )
@@ -53,6 +53,42 @@ class VCFColumnMismatch(ValidityCheckFailed):
         )
 
 
+class VCFColumnTypeMismatch(ValidityCheckFailed):
+    """
+    テーブルのカラムの宣言型が期待値と一致しない場合に発生する例外クラス
+    """
+
+    _expected_schema: dict[str, type]
+    _actual_schema: dict[str, type | None]
+
+    def __init__(
+        self,
+        table_name: str,
+        expected_schema: dict[str, type],
+        actual_schema: dict[str, type | None],
+    ):
+        """
+        Args:
+            table_name (str): テーブル名
+            expected_schema (dict[str, type]): 期待されるカラム名と型
+            actual_schema (dict[str, type | None]): 宣言型から求めたカラム名と型
+        """
+        self._expected_schema = expected_schema
+        self._actual_schema = actual_schema
+        super().__init__(table_name)
+
+    def __str__(self):
+        return textwrap.dedent(
+            f"""
+            カラムの型の不一致 (テーブル: '{self._table_name}')
+                期待されるスキーマ:
+                {self._expected_schema}
+                実際のスキーマ:
+                {self._actual_schema}
+            """
+        )
+
+
 class VCFInvalidRow(ValidityCheckFailed):
     """
     テーブルの行データに不正な型が含まれている場合に発生する例外クラス
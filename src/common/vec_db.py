@@ -1,10 +1,59 @@
+import sqlite3
+from contextlib import closing
+from typing import Optional, Sequence, Union
+
 from common.db import Db
+from common.serialize import vec_serialize, vec_serialize_int8
 import sqlite_vec
 
 
 class VecDb(Db):
+    def load_extensions(self, conn: sqlite3.Connection) -> None:
+        super().load_extensions(conn)
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+
     def post_conn_created(self):
         super().post_conn_created()
-        self.conn.enable_load_extension(True)
-        sqlite_vec.load(self.conn)
-        self.conn.enable_load_extension(False)
+        self.load_extensions(self.conn)
+
+    def knn(
+        self,
+        table: str,
+        col: str,
+        query_vec: Union[bytes, Sequence[float]],
+        k: int,
+        after_distance: Optional[float] = None,
+        int8: bool = True,
+    ) -> list:
+        """
+        vec0テーブルに対してKNN検索を行い、(poseId, distance)を距離の昇順で返す
+
+        vec_distance_*() を ORDER BY ... LIMIT で使うと全件走査になるため、
+        ベクトル検索は必ずこのメソッド(MATCH + k制約)を経由すること
+
+        Args:
+            table (str): 検索対象のvec0テーブル名(table_defに含まれている必要がある)
+            col (str): 検索対象のベクトルカラム名
+            query_vec (bytes | Sequence[float]): 検索ベクトル(シリアライズ済みでも可)
+            k (int): 取得件数
+            after_distance (Optional[float]): ページング用。前ページ最後の距離を渡すと、
+                                        それより遠い結果のみを返す(OFFSETは使わない)
+            int8 (bool): 検索対象がint8[N]カラムの場合はTrue(検索ベクトルもint8に量子化する)
+                                        リポジトリ内のvec0テーブルは全てint8なのでデフォルトはTrue
+        """
+        self._check_identifiers(table, [col])
+        if not isinstance(query_vec, bytes):
+            query_vec = (vec_serialize_int8 if int8 else vec_serialize)(query_vec)
+        match = "vec_int8(?)" if int8 else "?"
+        query = (
+            f"SELECT poseId, distance FROM {table} WHERE {col} MATCH {match} AND k = ?"
+        )
+        params: list = [query_vec, k]
+        if after_distance is not None:
+            query += " AND distance > ?"
+            params.append(after_distance)
+        query += " ORDER BY distance"
+        with closing(self.cursor()) as cur:
+            return cur.execute(query, params).fetchall()
@@ -6,7 +6,6 @@ import logging
 import functools
 from enum import Enum
 from typing import Optional, Union
-from pathlib import PurePosixPath, PureWindowsPath
 
 
 logger = logging.getLogger(__name__)
@@ -77,25 +76,23 @@ def is_wsl_environment() -> bool:
     - WSLのバリアントが検出できること、もしくは WSL_DISTRO_NAME/WSL_INTEROP が存在すること
     - /mnt/c が存在する場合は肯定判定を補強
     """
-    platform_flag = sys.platform.startswith("linux")
-    if not platform_flag:
+    if not sys.platform.startswith("linux"):
         return False
-
-    env_flag = any(key in os.environ for key in ("WSL_DISTRO_NAME", "WSL_INTEROP"))
-    variant = get_wsl_variant()
-    mnt_c_exists = os.path.isdir("/mnt/c")
-
-    if variant is not None:
-        return True
-    if env_flag and mnt_c_exists:
+    if get_wsl_variant() is not None:
         return True
-    return False
+    # ファイルシステムの確認(stat)は環境変数で判定できない場合のみ行う
+    if not any(key in os.environ for key in ("WSL_DISTRO_NAME", "WSL_INTEROP")):
+        return False
+    return os.path.isdir("/mnt/c")
 
 
+@functools.lru_cache(maxsize=4096)
 def _run_wslpath(path_str: str) -> str:
     """
     @brief wslpath を用いて POSIX → Windows 変換を実施
 
+    同一パスの変換結果はキャッシュし、サブプロセスの起動を省く
+    (失敗時の例外はキャッシュされない)
     実行に失敗した場合は PathConversionError を送出
     """
     wslpath_cmd = shutil.which("wslpath")
@@ -120,46 +117,48 @@ def _run_wslpath(path_str: str) -> str:
         raise PathConversionError(f"wslpath 実行不可: {e}") from e
 
 
-def _manual_mnt_drive_convert(posix_abs: PurePosixPath) -> Optional[str]:
+def _split_posix_abs(path_str: str) -> Optional[list[str]]:
+    """
+    @brief POSIX絶対パスを要素ごとに分割する (先頭の "/" は含まない)
+
+    空要素や "." は除去する。絶対パスでない場合は None を返す
+    """
+    if not path_str.startswith("/"):
+        return None
+    return [p for p in path_str.split("/") if p and p != "."]
+
+
+def _manual_mnt_drive_convert(posix_abs: Union[str, os.PathLike]) -> Optional[str]:
     """
     @brief /mnt/<drive> 形式のパスを手動で Windows ドライブ形式に変換
 
+    pathlib を介さず文字列操作のみで変換する
     対象でない場合は None を返す
     """
-    parts = posix_abs.parts
-    if len(parts) == 0 or parts[0] != "/":
+    parts = _split_posix_abs(os.fspath(posix_abs))
+    # parts 例: ['mnt', 'c', 'Users', 'name']
+    if parts is None or len(parts) < 2 or parts[0] != "mnt":
         return None
-
-    # parts 例: ('/', 'mnt', 'c', 'Users', 'name')
-    idx_mnt = 1 if len(parts) > 1 and parts[0] == "/" else 0
-    if len(parts) > idx_mnt + 1 and parts[idx_mnt] == "mnt":
-        drive_letter = parts[idx_mnt + 1].upper()
-        if len(drive_letter) != 1 or not drive_letter.isalpha():
-            return None
-        drive = f"{drive_letter}:\\"
-        rest_parts = parts[idx_mnt + 2 :]
-        if rest_parts:
-            win_path = PureWindowsPath(drive, *rest_parts)
-            return str(win_path)
-        return drive
-    return None
+    drive_letter = parts[1].upper()
+    if len(drive_letter) != 1 or not drive_letter.isalpha():
+        return None
+    return f"{drive_letter}:\\" + "\\".join(parts[2:])
 
 
-def _wsl_unc_fallback(posix_abs: PurePosixPath) -> Optional[str]:
+def _wsl_unc_fallback(posix_abs: Union[str, os.PathLike]) -> Optional[str]:
     """
     @brief \\wsl$\\<distro> UNC 経路へのフォールバック生成
 
     WSL_DISTRO_NAME が存在し、絶対パスの場合のみ生成
     """
     distro = os.environ.get("WSL_DISTRO_NAME")
-    if not distro or not posix_abs.is_absolute():
+    if not distro:
         return None
-
-    parts = list(posix_abs.parts)
-    # 先頭の "/" を除去し Windows 区切りに変換
-    if parts and parts[0] == "/":
-        parts = parts[1:]
-    tail = "\\".join(parts) if parts else ""
+    parts = _split_posix_abs(os.fspath(posix_abs))
+    if parts is None:
+        return None
+    # Windows 区切りに変換
+    tail = "\\".join(parts)
     return f"\\\\wsl$\\{distro}\\{tail}"
 
 
@@ -173,8 +172,8 @@ def posix_to_windows(
     @brief POSIXパスをWindowsパスに変換する
 
     優先順位
-    1. WSL環境なら wslpath を利用
-    2. /mnt/<drive> の手動変換
+    1. /mnt/<drive> の手動変換 (サブプロセスを起動しないので最優先)
+    2. WSL環境なら wslpath を利用
     3. WSL UNC 経路へのフォールバック (任意)
     4. 非WSL環境では入力をそのまま返す
 
@@ -191,23 +190,22 @@ def posix_to_windows(
 
     in_wsl = is_wsl_environment()
 
-    # 1. wslpath 試行
+    # 1. /mnt/<drive> 手動変換
+    if in_wsl and path_str.startswith("/mnt/"):
+        manual = _manual_mnt_drive_convert(path_str)
+        if manual is not None:
+            return manual
+
+    # 2. wslpath 試行
     if in_wsl:
         try:
             return _run_wslpath(path_str)
         except PathConversionError as e:
             logger.debug("wslpath 失敗: %s", e)
 
-    # 2. /mnt/<drive> 手動変換
-    posix = PurePosixPath(path_str)
-    if in_wsl and posix.is_absolute():
-        manual = _manual_mnt_drive_convert(posix)
-        if manual is not None:
-            return manual
-
     # 3. UNC フォールバック
-    if in_wsl and allow_unc_fallback and posix.is_absolute():
-        unc = _wsl_unc_fallback(posix)
+    if in_wsl and allow_unc_fallback and path_str.startswith("/"):
+        unc = _wsl_unc_fallback(path_str)
         if unc is not None:
             return unc
 
@@ -7,31 +7,38 @@ from common.db_readwrite import add_optional_arguments_to_parser, calc_landmark_
 from common.log import apply_logging_option
 from common.types import TableDef
 from common.vec_db import Db
-from desc.crus_dir import Table_Def, init_table_query
+from desc.crus_dir import Table_Def, index_query, init_table_query
+
+# (膝, 足首)のランドマークインデックス対 [左, 右]
+_CRUS_LANDMARK_PAIRS: tuple[tuple[int, int], tuple[int, int]] = (
+    (CLm.left_knee.value, CLm.left_ankle.value),
+    (CLm.right_knee.value, CLm.right_ankle.value),
+)
 
 
 class CrusDirDB(Db):
     def __init__(self, dbpath: str, clear_table: bool):
-        super().__init__(dbpath, clear_table, row_name=True)
+        super().__init__(dbpath, clear_table)
 
     @property
     def init_query(self) -> str:
         return init_table_query()
 
+    @property
+    def index_query(self) -> str:
+        return index_query()
+
     @property
     def table_def(self) -> TableDef:
         return Table_Def
 
     def calculate(self):
-        with closing(self.cursor()) as cur:
-            calc_landmark_dir(
-                cur,
-                [
-                    (CLm.left_knee.value, CLm.left_ankle.value),
-                    (CLm.right_knee.value, CLm.right_ankle.value),
-                ],
-                "MasseCrusDir",
-            )
+        # 全ポーズ分の書き込みを1つのトランザクションにまとめる
+        with self.transaction(), closing(self.cursor()) as cur:
+            calc_landmark_dir(cur, _CRUS_LANDMARK_PAIRS, "MasseCrusDir")
+            # 統計情報が無いとCrusFlexionの算出時に一意インデックス(テーブル参照あり)が選ばれるので、
+            # カバリングインデックスが選ばれるよう統計情報を更新しておく
+            cur.execute("ANALYZE MasseCrusDir")
 
 
 def process(database_path: Path, init_db: bool) -> None:
@@ -1,14 +1,30 @@
 import argparse
-from contextlib import closing
+from contextlib import closing, suppress
 from pathlib import Path
 
+from common.argparse_aux import str_to_bool
 from common.db import Db
 from common.log import apply_logging_option
 from common.types import TableDef
 from desc.crus_flexion import Table_Def, init_table_query
 
-# オプションは同じなので使いまわし
-from reliability_db import add_optional_arguments_to_parser
+# 共通のオプションは同じなので使いまわし
+from reliability_db import (
+    add_optional_arguments_to_parser as add_common_arguments_to_parser,
+)
+
+
+def add_optional_arguments_to_parser(parser: argparse.ArgumentParser) -> None:
+    add_common_arguments_to_parser(parser)
+    # 計算済みのポーズも計算し直すか
+    with suppress(argparse.ArgumentError):
+        parser.add_argument(
+            "--force",
+            type=str_to_bool,
+            default=False,
+            help="Recalculate all crus flexions"
+            " (default: only poses not yet calculated)",
+        )
 
 
 class CrusFlexionDB(Db):
@@ -29,10 +45,14 @@ class CrusFlexionDB(Db):
         # テーブル定義を返す
         return Table_Def
 
-    def calculate_flexion(self):
+    def calculate_flexion(self, force: bool = False):
         """
         MasseThighDir（大腿方向）と MasseCrusDir（下腿方向）の内積から
         膝関節の屈曲角度を計算して CrusFlexion に格納する
+
+        Args:
+            force (bool): Trueの場合は全ポーズを計算し直す
+                          Falseの場合はCrusFlexionに未登録のポーズのみ計算する
         """
         query_str = """
             INSERT INTO CrusFlexion (poseId, is_right, angleRad)
@@ -48,19 +68,22 @@ class CrusFlexionDB(Db):
             JOIN MasseCrusDir  AS c
               ON t.poseId   = c.poseId
              AND t.is_right = c.is_right
-
-            -- 既に CrusFlexion に同じキーがある場合は更新
-            ON CONFLICT(poseId, is_right) DO UPDATE
-            SET angleRad = excluded.angleRad;
+            -- 計算済みのポーズは除外 (差分のみ計算)
+            LEFT JOIN CrusFlexion AS f
+              ON f.poseId   = t.poseId
+             AND f.is_right = t.is_right
+            WHERE f.poseId IS NULL;
         """
 
-        with closing(self.cursor()) as cur:
+        with self.transaction(), closing(self.cursor()) as cur:
+            if force:
+                cur.execute("DELETE FROM CrusFlexion")
             cur.execute(query_str)
 
 
-def process(database_path: Path, init_db: bool) -> None:
+def process(database_path: Path, init_db: bool, force: bool = False) -> None:
     with CrusFlexionDB(database_path, init_db) as db:
-        db.calculate_flexion()
+        db.calculate_flexion(force)
 
 
 if __name__ == "__main__":
@@ -74,4 +97,4 @@ if __name__ == "__main__":
 
     argv = init_parser().parse_args()
     apply_logging_option(argv)
-    process(argv.database_path, argv.init_db)
+    process(argv.database_path, argv.init_db, argv.force)
@@ -11,8 +11,8 @@ import math
 # 1.0 = 伸展
 # 0 = 90度曲がった状態
 # -1.0 = 屈曲
-def init_table_query() -> str:
-    return """
+# テーブル初期化クエリ文 (import時に一度だけ生成する)
+_INIT_QUERY: str = """
         CREATE TABLE CrusFlexion (
             poseId      INTEGER REFERENCES Pose(id),
             is_right    INTEGER NOT NULL CHECK(is_right IN (0,1)),  -- 0 = L, 1 = R
@@ -22,6 +22,10 @@ def init_table_query() -> str:
     """.format(pi=math.pi)
 
 
+def init_table_query() -> str:
+    return _INIT_QUERY
+
+
 Table_Def: TableDef = {
     "CrusFlexion": {
         "poseId": int,
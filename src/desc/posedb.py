@@ -76,6 +76,18 @@ def init_table_query() -> str:
     """
 
 
+# インデックス作成クエリ文
+# (テーブル作成後、既存のデータベースに対しても毎回発行する)
+def index_query() -> str:
+    return """
+        -- ランドマーク座標・信頼度の参照をインデックスのみで完結させる(カバリングインデックス)
+        -- (confidenceを含まない旧インデックスは置き換える)
+        DROP INDEX IF EXISTS idx_landmark_cover;
+        CREATE INDEX IF NOT EXISTS idx_landmark_cover_conf
+            ON Landmark(poseId, landmarkIndex, confidence, x, y, z);
+    """
+
+
 Table_Def: TableDef = {
     "Meta": {
         "partialHash": int,
@@ -15,8 +15,10 @@ def init_table_query() -> str:
             CHECK((x*x + y*y + z*z) BETWEEN 0.995 AND 1.005)            -- should be unit vector
         );
         CREATE VIRTUAL TABLE MasseSpineVec USING vec0(
-            poseId      INTEGER NOT NULL UNIQUE,
-            dir         float[3]
+            -- vec0のrowidとして格納し、poseIdでの削除を全件走査にしない
+            -- (メタデータ列のUNIQUEは強制されず、WHERE poseId=? も全件走査になる)
+            poseId      INTEGER PRIMARY KEY,
+            dir         int8[3] distance_metric=cosine     -- [-1, 1]を127倍して量子化
         );
     """
 
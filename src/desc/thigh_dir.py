@@ -19,6 +19,17 @@ def init_table_query() -> str:
     """
 
 
+# インデックス作成クエリ文
+# (テーブル作成後、既存のデータベースに対しても毎回発行する)
+def index_query() -> str:
+    return """
+        -- CrusFlexionの算出で(poseId, is_right)から引いた方向ベクトルを
+        -- テーブル本体を参照せずに読めるようにする(カバリングインデックス)
+        CREATE INDEX IF NOT EXISTS idx_thigh_dir_cover
+            ON MasseThighDir(poseId, is_right, x, y, z);
+    """
+
+
 Table_Def: TableDef = {
     "MasseThighDir": {
         "poseId": int,
@@ -21,10 +21,13 @@ def init_table_query() -> str:
             CHECK((yaw_x*yaw_x + yaw_z*yaw_z) BETWEEN 0.995 AND 1.005)  -- should be unit vector
         );
         CREATE VIRTUAL TABLE MasseTorsoVec USING vec0(
-            poseId      INTEGER NOT NULL UNIQUE,
-            dir         float[3],
-            yaw         float[2],
-            pitch       float[1]
+            -- vec0のrowidとして格納し、poseIdでの削除を全件走査にしない
+            -- (メタデータ列のUNIQUEは強制されず、WHERE poseId=? も全件走査になる)
+            poseId      INTEGER PRIMARY KEY,
+            -- 各値は[-1, 1]の範囲なので、127倍してint8に量子化して格納する
+            dir         int8[3] distance_metric=cosine,
+            yaw         int8[2] distance_metric=cosine,
+            pitch       int8[1]
         );
     """
 
@@ -8,7 +8,7 @@ Vec2 = tuple[float, float]
 DEFAULT_CONFIDENCE_THRESHOLD: float = 0.5
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Landmark:
     """
     姿勢推定されたランドマークの情報を保持するデータクラス。
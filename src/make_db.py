@@ -62,6 +62,8 @@ def build_modules() -> List[ModuleTask]:
                 a.init_db,
                 a.max_workers,
                 a.use_partial_hash,
+                a.durable,
+                a.delegate,
             ),
             check_result=True,
         ),
@@ -74,7 +76,7 @@ def build_modules() -> List[ModuleTask]:
         ModuleTask("ThighDir", thigh, lambda a: (a.database_path, a.init_db)),
         ModuleTask("ThighFlex", th_flex, lambda a: (a.database_path, a.init_db)),
         ModuleTask("CrusDir", crus_dir, lambda a: (a.database_path, a.init_db)),
-        ModuleTask("CrusFlex", c_flex, lambda a: (a.database_path, a.init_db)),
+        ModuleTask("CrusFlex", c_flex, lambda a: (a.database_path, a.init_db, a.force)),
     ]
 
 
@@ -1,13 +1,25 @@
 import argparse
 import logging as L
+import multiprocessing
+import multiprocessing.util
 import os
-import re
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import sqlite3
+import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from contextlib import closing, suppress
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from itertools import islice
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Optional
 
 import blake3
+import numpy as np
 from tqdm import tqdm
 
 from common import default_path, log
@@ -17,11 +29,34 @@ from common.db import Db
 from common.rect import Rect2D
 from common.types import TableDef
 from common.wsl import is_wsl_environment, posix_to_windows
-from desc.posedb import Table_Def, init_table_query
-from pose_estimate_blazepose import Estimate, EstimateFailed, Landmark
+from desc.posedb import Table_Def, index_query, init_table_query
+from landmark_blazepose import Landmark
+
+if TYPE_CHECKING:
+    # MediaPipeの読み込みは重いので、実際に推定を行うまで遅延させる
+    from pose_estimate_blazepose import Estimate
 
 # MediaPipe Pose Landmarkerのモデルファイルパス
 DEFAULT_MODEL_PATH = default_path.TEST_DATA_PATH / "pose_landmarker_heavy.task"
+# 処理対象とする画像ファイルの拡張子 (小文字)
+IMAGE_SUFFIXES = frozenset({".jpg", ".jpeg"})
+# ワーカー1つあたりの未完了タスク数の上限
+PENDING_PER_WORKER = 4
+# 推定結果をこの画像数ごとに書き込み、コミットする
+COMMIT_INTERVAL = 500
+
+# BlazePose → COCO の対応 (COCOのインデックス順)
+_COCO_INDEX: tuple[int, ...] = tuple(int(c) for c in BLAZEPOSE_TO_COCO.values())
+_COCO_SOURCE_INDEX: tuple[int, ...] = tuple(int(b) for b in BLAZEPOSE_TO_COCO.keys())
+# noseの行番号 (bboxのマージン判定に使用)
+_NOSE_ROW: int = _COCO_INDEX.index(CocoLandmark.nose.value)
+# _pack_landmarks()が返す配列の列数 (confidence, x, y, z, x_2d, y_2d)
+_LANDMARK_COLS = 6
+# 1ポーズ分のランドマーク(COCOの17点)をまとめて挿入する文
+# (行毎にバインドせず、1ポーズ1回の実行で済ませる)
+_LANDMARK_INSERT = "INSERT INTO Landmark VALUES " + ",".join(
+    ["(?,?,?,?,?,?,?,?)"] * len(_COCO_INDEX)
+)
 
 
 class Hasher:
@@ -29,15 +64,18 @@ class Hasher:
     PARTIAL_BLOCK_SIZE = 128 * 1024
 
     @staticmethod
-    def calc_hash(path: Path, partial_hash: bool) -> bytes:
+    def calc_hash(
+        path: Path, partial_hash: bool, file_size: Optional[int] = None
+    ) -> bytes:
         h = blake3.blake3()
-        file_size = path.stat().st_size
+        if file_size is None:
+            file_size = path.stat().st_size
 
         # ファイルサイズをまずハッシュに含める
         h.update(str(file_size).encode("utf-8"))
 
-        with path.open("rb") as img:
-            if partial_hash and file_size > Hasher.PARTIAL_BLOCK_SIZE * 3:
+        if partial_hash and file_size > Hasher.PARTIAL_BLOCK_SIZE * 3:
+            with path.open("rb") as img:
                 # 先頭
                 img.seek(0)
                 h.update(img.read(Hasher.PARTIAL_BLOCK_SIZE))
@@ -50,10 +88,10 @@ class Hasher:
                 # 末尾
                 img.seek(max(0, file_size - Hasher.PARTIAL_BLOCK_SIZE))
                 h.update(img.read(Hasher.PARTIAL_BLOCK_SIZE))
-            else:
-                # 全体ハッシュ
-                for chunk in iter(lambda: img.read(8192), b""):
-                    h.update(chunk)
+        else:
+            # 全体ハッシュ
+            # (メモリマップしてネイティブ側で一括処理する。Pythonでのチャンク読み込みを省く)
+            h.update_mmap(path)
 
         return h.digest()
 
@@ -61,23 +99,47 @@ class Hasher:
 @dataclass
 class ImageTask:
     path: Path
-    image_id: int
+    # Fileテーブルに書き込む情報 (推定結果と同時に登録する)
+    path_to_write: str
+    size: int
+    timestamp: int
+    hash: bytes
+
+
+@dataclass
+class FileIndex:
+    # パス -> (size, timestamp, fileId, hash)
+    by_path: dict[str, tuple[int, int, int, bytes]] = field(default_factory=dict)
+    # ハッシュ値 -> fileId
+    by_hash: dict[bytes, int] = field(default_factory=dict)
+    # 今回見つからなかった登録済みファイルの (size, timestamp) -> ハッシュ値のリスト
+    vanished: dict[tuple[int, int], list[bytes]] = field(default_factory=dict)
 
 
 @dataclass
-class LandmarkData:
-    pose_id: int
-    landmark_index: int
-    confidence: float
-    x: float
-    y: float
-    z: float
-    x_2d: float
-    y_2d: float
+class ImageRows:
+    """1画像分の書き込み待ちの行"""
+
+    task: ImageTask
+    file: tuple
+    poses: list[tuple] = field(default_factory=list)
+    # 1ポーズ分(COCOの17点)のランドマークを1つのタプルにまとめたもの
+    landmarks: list[tuple] = field(default_factory=list)
+    rects: list[tuple] = field(default_factory=list)
 
 
 class PoseDB(Db):
     _partial_hash: bool
+    _in_wsl: bool
+    _buffer: list[ImageRows]
+    # 移動したファイルの (新しいパス, ハッシュ値) (update_moved_files()でまとめて書き込む)
+    _moved: list[tuple[str, bytes]]
+    # 次に採番するID (未読み込みの場合はNone)
+    _next_file_id: Optional[int]
+    _next_pose_id: Optional[int]
+
+    # 推定結果を書き込み続けるので、途中で他の書き込みとロックを競合させない
+    BEGIN_STATEMENT = "BEGIN IMMEDIATE"
 
     def __init__(
         self,
@@ -85,14 +147,25 @@ class PoseDB(Db):
         clear_table: bool,
         use_partial_hash: bool,
         row_name: bool = False,
+        durable: bool = False,
     ):
-        super().__init__(dbpath, clear_table, row_name)
+        super().__init__(dbpath, clear_table, row_name, durable=durable)
         self._partial_hash = use_partial_hash
+        # WSL判定はプロセス中で変わらないので、ファイル毎に問い合わせず保持しておく
+        self._in_wsl = is_wsl_environment()
+        self._buffer = []
+        self._moved = []
+        self._next_file_id = None
+        self._next_pose_id = None
 
     @property
     def init_query(self) -> str:
         return init_table_query()
 
+    @property
+    def index_query(self) -> str:
+        return index_query()
+
     @property
     def table_def(self) -> TableDef:
         return Table_Def
@@ -100,162 +173,283 @@ class PoseDB(Db):
     def post_table_initialized(self) -> None:
         with closing(self.cursor()) as cur:
             # ランドマーク名のリストを作成し、データベースに挿入する（COCO準拠）
-            index = 0
-            for n in CocoLandmark:
-                cur.execute(
-                    "INSERT INTO LandmarkName(id, name) VALUES (?,?)",
-                    (
-                        index,
-                        n.name,
-                    ),
-                )
-                index += 1
+            cur.executemany(
+                "INSERT INTO LandmarkName(id, name) VALUES (?,?)",
+                ((index, n.name) for index, n in enumerate(CocoLandmark)),
+            )
 
             # Meta情報
             cur.execute("INSERT INTO Meta VALUES (?)", (self._partial_hash,))
 
-    def register_imagefile(self, path: Path) -> tuple[bool, int]:
-        L.debug(f"register_imagefile: {path}")
-        stat = path.stat()  # ファイルの更新時刻を取得
-        # たまにintでない事があるので明示的に変換
-        st_mtime = int(stat.st_mtime)
+    def load_file_index(self) -> FileIndex:
+        """
+        登録済みファイルの情報を一括で読み込む
+        (ファイル毎にSELECTを発行しないようにするため)
+        """
+        index = FileIndex()
         with closing(self.cursor()) as cur:
-            # 既に登録した画像は計算を省く
-            cur.execute(
-                "SELECT size, timestamp, id FROM File WHERE path=?", (path.as_posix(),)
+            cur.execute("SELECT path, size, timestamp, id, hash FROM File")
+            for path, size, timestamp, file_id, checksum in cur:
+                index.by_path[path] = (size, timestamp, file_id, checksum)
+                index.by_hash[checksum] = file_id
+        return index
+
+    def find_vanished_files(
+        self,
+        index: FileIndex,
+        target_dir: Path,
+        image_paths: list[tuple[Path, os.stat_result]],
+    ) -> None:
+        """
+        登録済みのtarget_dir以下のファイルのうち、
+        今回の列挙で見つからなかったもの(移動元の候補)を
+        (size, timestamp)毎にindex.vanishedへまとめる
+        """
+        if self._in_wsl:
+            # WSLでは登録パスがWindows形式のため列挙したパスと照合できない
+            return
+        # 他のディレクトリから登録されたファイルは今回列挙していないので、候補にしない
+        prefix = target_dir.absolute().as_posix().rstrip("/") + "/"
+        found = {path.as_posix() for path, _ in image_paths}
+        for path, (size, timestamp, _, checksum) in index.by_path.items():
+            if path.startswith(prefix) and path not in found:
+                index.vanished.setdefault((size, timestamp), []).append(checksum)
+
+    @staticmethod
+    def _mtime(stat: os.stat_result) -> int:
+        # 秒単位の整数に切り捨てる (floatを経由しないようナノ秒の値から計算)
+        return stat.st_mtime_ns // 1_000_000_000
+
+    def needs_hash(self, path: Path, stat: os.stat_result, index: FileIndex) -> bool:
+        """
+        ハッシュ値の計算が必要か(サイズと更新時刻だけでは登録済みと判断できないか)を返す
+
+        Args:
+            path (Path): 画像ファイルのパス
+            stat (os.stat_result): 画像ファイルのstat (列挙時に取得したものを使い回す)
+            index (FileIndex): load_file_index()で読み込んだ登録済みファイルの情報
+        """
+        ent = index.by_path.get(path.as_posix())
+        if ent is not None:
+            # ファイルサイズと更新時刻が一致する場合、既に登録済みと判断
+            if stat.st_size == ent[0] and self._mtime(stat) == ent[1]:
+                L.debug(f"already registered file(size and time): {path}")
+                return False
+            return True
+        # 未登録のパスでも、見つからなくなったファイルとサイズ・更新時刻が一致し、
+        # 候補が1つに絞れる場合はファイルが移動したと判断する(ハッシュ計算を省く)
+        moved_from = index.vanished.get((stat.st_size, self._mtime(stat)))
+        if moved_from is not None and len(moved_from) == 1:
+            self._moved.append((self._path_to_write(path), moved_from.pop()))
+            L.debug(f"already registered file(moved file, size and time): {path}")
+            return False
+        return True
+
+    def _path_to_write(self, path: Path) -> str:
+        # Fileテーブルに書き込むパス (WSLではWindows形式)
+        return path.as_posix() if not self._in_wsl else posix_to_windows(str(path))
+
+    def calc_hash(self, path: Path, stat: os.stat_result) -> bytes:
+        """
+        ハッシュ値計算 (BLAKE3)
+        DBにはアクセスしないので、別スレッドから呼び出してよい
+        """
+        # ファイルサイズは列挙時のstatを使い、statを再発行しない
+        return Hasher.calc_hash(path, self._partial_hash, stat.st_size)
+
+    def check_imagefile(
+        self, path: Path, stat: os.stat_result, checksum: bytes, index: FileIndex
+    ) -> Optional[ImageTask]:
+        """
+        ハッシュ値から画像ファイルが登録済みか確認する
+        未登録の場合は登録用の情報(ImageTask)を返す(Fileテーブルへの書き込みは行わない)
+
+        Args:
+            path (Path): 画像ファイルのパス
+            stat (os.stat_result): 画像ファイルのstat (列挙時に取得したものを使い回す)
+            checksum (bytes): calc_hash()で計算したハッシュ値
+            index (FileIndex): load_file_index()で読み込んだ登録済みファイルの情報
+        """
+        L.debug(f"check_imagefile: {path}")
+        path_to_write = self._path_to_write(path)
+        # あるいは、ファイルが移動した場合を考える
+        if checksum in index.by_hash:
+            # ハッシュ値が一致する場合、ファイルが移動したと判断し、パスを更新
+            # (UPDATEは次の書き込み時にまとめて発行する)
+            self._moved.append((path_to_write, checksum))
+            L.debug("already registered file(moved file)")
+            return None
+
+        return ImageTask(
+            path=path,
+            path_to_write=path_to_write,
+            size=stat.st_size,
+            timestamp=self._mtime(stat),
+            hash=checksum,
+        )
+
+    def update_moved_files(self) -> None:
+        """
+        check_imagefile()で検出した移動済みファイルのパスをまとめて更新する
+        """
+        if not self._moved:
+            return
+        moved, self._moved = self._moved, []
+        with closing(self.cursor()) as cur:
+            cur.executemany("UPDATE File SET path=? WHERE hash=?", moved)
+
+    def _seed_ids(self) -> None:
+        """
+        バッファに積む行のIDを採番するため、現在の最大IDを読み込む
+        """
+        if self._next_file_id is not None:
+            return
+        with closing(self.cursor()) as cur:
+            self._next_file_id = cur.execute(
+                "SELECT IFNULL(MAX(id), 0) + 1 FROM File"
+            ).fetchone()[0]
+            self._next_pose_id = cur.execute(
+                "SELECT IFNULL(MAX(id), 0) + 1 FROM Pose"
+            ).fetchone()[0]
+
+    def write_image_result(self, task: ImageTask, marks: np.ndarray) -> None:
+        """
+        ファイル登録と推定結果(複数人物)を書き込みバッファに積む
+        実際の書き込みはflush_buffers()でまとめて行う
+        """
+        self._seed_ids()
+        file_id = self._next_file_id
+        self._next_file_id += 1
+        L.debug(f"fileId={file_id}")
+        rows = ImageRows(
+            task=task,
+            file=(file_id, task.path_to_write, task.size, task.timestamp, task.hash),
+        )
+        if len(marks) > 0:
+            # 複数人物分をまとめて処理する
+            first_pose_id = self._next_pose_id
+            self._next_pose_id += len(marks)
+            self.write_landmarks(rows, first_pose_id, marks)
+        self._buffer.append(rows)
+
+    def flush_buffers(self) -> None:
+        """
+        バッファに積んだ行をexecutemanyでまとめて書き込む
+        失敗した場合は画像単位で書き込み直し、書き込めなかった画像は未登録のまま残す
+        (次回実行時に再処理される)
+        """
+        # 移動前のパスに新しいファイルが置かれた場合に備え、パスの更新を先に行う
+        self.update_moved_files()
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+        try:
+            with self.transaction():
+                self._insert_rows(buffer)
+        except sqlite3.Error as exc:
+            L.warning(f"Batch write failed ({exc}). Retrying per image.")
+            for rows in buffer:
+                try:
+                    with self.transaction():
+                        self._insert_rows([rows])
+                except sqlite3.Error as exc:
+                    L.error(f"{rows.task.path} could not be written: {exc}")
+
+    def _insert_rows(self, buffer: list[ImageRows]) -> None:
+        # 行はジェネレータで渡し、executemany用の中間リストを作らない
+        # (SQL文は固定の文字列なのでプリペアドステートメントのキャッシュが効く)
+        with closing(self.cursor()) as cur:
+            cur.executemany(
+                "INSERT INTO File(id, path, size, timestamp, hash) VALUES (?,?,?,?,?)",
+                (r.file for r in buffer),
             )
-            ent = cur.fetchone()
-            if ent is not None:
-                # ファイルサイズと更新時刻が一致する場合、既に登録済みと判断
-                if stat.st_size == ent[0] and st_mtime == ent[1]:
-                    L.debug("already registered file(size and time)")
-                    return False, ent[2]  # 登録済みフラグとファイルIDを返す
-
-            # ハッシュ値計算 (BLAKE3)
-            checksum: bytes = Hasher.calc_hash(path, self._partial_hash)
-
-            # あるいは、ファイルが移動した場合を考える
-            cur.execute("SELECT id FROM File WHERE hash=?", (checksum,))
-            ent = cur.fetchone()
-
-            path_to_write = (
-                path.as_posix()
-                if not is_wsl_environment()
-                else posix_to_windows(str(path))
+            cur.executemany(
+                "INSERT INTO Pose(id, fileId, personIndex) VALUES (?,?,?)",
+                (p for r in buffer for p in r.poses),
             )
-            if ent is not None:
-                # ハッシュ値が一致する場合、ファイルが移動したと判断し、パスを更新
-                cur.execute(
-                    "UPDATE File SET path=? WHERE hash=?", (path_to_write, checksum)
-                )
-                L.debug("already registered file(moved file)")
-                return False, ent[0]  # 登録済みフラグとファイルIDを返す
-            else:
-                L.debug("generating FileId")
-
-            # テーブルに格納
-            cur.execute(
-                "INSERT INTO File(path, size, timestamp, hash) VALUES (?,?,?,?)",
-                (
-                    path_to_write,
-                    stat.st_size,
-                    st_mtime,
-                    checksum,
-                ),
+            cur.executemany(
+                _LANDMARK_INSERT,
+                (lm for r in buffer for lm in r.landmarks),
+            )
+            cur.executemany(
+                "INSERT INTO PoseRect VALUES(?,?,?,?,?)",
+                (rc for r in buffer for rc in r.rects),
             )
-            # 新規登録フラグとファイルIDを返す
-            return True, cur.lastrowid
 
-    def _remove_file(self, path: Path) -> None:
-        # 指定されたパスのファイルをデータベースから削除する
-        L.debug(f"removing file entry '{path}'")
+    def commit(self) -> None:
+        # バッファに残っている行を書き込んでからコミットする
+        self.flush_buffers()
+        super().commit()
 
+    def __exit__(
+        self,
+        e_type: Optional[type],
+        e_value: Optional[Exception],
+        traceback: Optional[Any],
+    ) -> bool:
+        if self.conn is not None:
+            # 中断された場合も、推定済みの結果は書き込んでおく
+            self.flush_buffers()
+        return super().__exit__(e_type, e_value, traceback)
+
+    def _remove_files(self, paths: Iterable[Path]) -> None:
+        # 指定されたパスのファイルをデータベースからまとめて削除する
+        params = [(path.as_posix(),) for path in paths]
+        L.debug(f"removing {len(params)} file entries")
+
+        # 削除対象のPoseId
+        pose_ids = """
+            SELECT Pose.id FROM Pose
+                INNER JOIN File ON File.id = Pose.fileId
+                WHERE File.path=?
+        """
         with closing(self.cursor()) as cur:
-            # ---- File ----
-            cur.execute("SELECT id FROM File WHERE path=?", (path.as_posix(),))
-            ent = cur.fetchone()
-            if ent is None:
-                L.debug("not found")
-                return
-            file_id: int = ent[0]
-
-            # ---- Pose ----
-            cur.execute("SELECT id FROM Pose WHERE fileId=?", (file_id,))
-            for ent in cur.fetchall():
-                pose_id = ent[0]
-                # ---- Landmark ----
-                # 関連するランドマークを削除
-                cur.execute("DELETE FROM Landmark WHERE poseId=?", (pose_id,))
+            # 関連するランドマーク・バウンディングボックスを削除
+            cur.executemany(
+                f"DELETE FROM Landmark WHERE poseId IN ({pose_ids})", params
+            )
+            cur.executemany(
+                f"DELETE FROM PoseRect WHERE poseId IN ({pose_ids})", params
+            )
             # 関連する姿勢推定結果を削除
-            cur.execute("DELETE FROM Pose WHERE fileId=?", (file_id,))
-            # ---- Pose End ----
+            cur.executemany(
+                "DELETE FROM Pose WHERE fileId IN (SELECT id FROM File WHERE path=?)",
+                params,
+            )
             # ファイル情報を削除
-            cur.execute("DELETE FROM File WHERE id=?", (file_id,))
-            # ---- File End ----
-            L.debug("done")
+            cur.executemany("DELETE FROM File WHERE path=?", params)
+            L.debug(f"{cur.rowcount} file entries removed")
 
     def write_landmarks(
-        self, file_id: int, person_id: int, marks: list[Landmark]
+        self, rows: ImageRows, first_pose_id: int, values: np.ndarray
     ) -> None:
         """
-        marksはBlazePoseの33点を想定。COCOの17点へ射影して保存する。
+        _pack_landmarks()で変換した(人数, 17, 6)の配列をrowsに積む。
+        PoseIdは人物の順にfirst_pose_idから割り当てる。
         """
-        with closing(self.cursor()) as cur:
-            # PoseIdを作成
-            cur.execute(
-                "INSERT INTO Pose(fileId, personIndex) VALUES (?,?)",
-                (file_id, person_id),
-            )
-            # 新規姿勢推定IDを取得
-            pose_id: int = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+        # bboxはCOCOの2Dランドマークから算出 (全員分をまとめて計算)
+        pos_2d = values[:, :, 4:6]
+        mins = pos_2d.min(axis=1).tolist()
+        maxs = pos_2d.max(axis=1).tolist()
+        nose_ys = pos_2d[:, _NOSE_ROW, 1].tolist()
+
+        RECT_MARGIN = 0.1
+        ADDITIONAL_MARGIN = 0.1
+        for index, person_values in enumerate(values.tolist()):
+            pose_id = first_pose_id + index
             L.debug(f"poseId={pose_id}")
-
-            # COCOランドマークを抽出してテーブルに格納
-            lms: list[LandmarkData] = []
-            for blaze_idx, coco_idx in BLAZEPOSE_TO_COCO.items():
-                m = marks[blaze_idx.value]
-                lms.append(
-                    LandmarkData(
-                        pose_id=pose_id,
-                        landmark_index=coco_idx.value,
-                        confidence=m.visibility,
-                        x=m.pos[0],
-                        y=-m.pos[1],  # Y軸は反転
-                        z=m.pos[2],
-                        x_2d=m.pos_2d[0],  # 2d_x
-                        y_2d=m.pos_2d[1],  # 2d_y
-                    )
+            rows.poses.append((pose_id, rows.file[0], index))
+            rows.landmarks.append(
+                tuple(
+                    col
+                    for coco_idx, v in zip(_COCO_INDEX, person_values)
+                    for col in (pose_id, coco_idx, *v)
                 )
-            cur.executemany(
-                "INSERT INTO Landmark VALUES (?,?,?,?,?,?,?,?)",
-                [
-                    (
-                        lm.pose_id,
-                        lm.landmark_index,
-                        lm.confidence,
-                        lm.x,
-                        lm.y,
-                        lm.z,
-                        lm.x_2d,
-                        lm.y_2d,
-                    )
-                    for lm in lms
-                ],
             )
 
-            # bboxはCOCOの2Dランドマークから算出
-            xs = [lm.x_2d for lm in lms]
-            ys = [lm.y_2d for lm in lms]
-            min_x, max_x = min(xs), max(xs)
-            min_y, max_y = min(ys), max(ys)
-
+            (min_x, min_y), (max_x, max_y) = mins[index], maxs[index]
             bbox = Rect2D(min_x, min_y, max_x, max_y)
-            RECT_MARGIN = 0.1
-            ADDITIONAL_MARGIN = 0.1
-            # COCOのnoseはインデックス0
-            nose_index = CocoLandmark.nose.value
-            nose_y = lms[nose_index].y_2d
-            should_margin = nose_y <= min_y + 0.05
+            should_margin = nose_ys[index] <= min_y + 0.05
             bbox = bbox.add_margin_sides(
                 RECT_MARGIN,
                 RECT_MARGIN,
@@ -264,29 +458,154 @@ class PoseDB(Db):
             ).clip_0_1()
 
             L.debug(f"bbox={bbox}")
-            cur.execute(
-                "INSERT INTO PoseRect VALUES(?,?,?,?,?)",
-                (pose_id, bbox.x_min, bbox.x_max, bbox.y_min, bbox.y_max),
-            )
+            rows.rects.append((pose_id, bbox.x_min, bbox.x_max, bbox.y_min, bbox.y_max))
+
 
-            L.debug("Success")
+def _pack_landmarks(marks: list[list[Landmark]]) -> np.ndarray:
+    """
+    人物毎のBlazePoseの33点をCOCOの17点へ射影し、(人数, 17, 6)の配列にまとめる
+    各行: (confidence, x, y, z, x_2d, y_2d) (Y軸は反転済み)
+    """
+    values = np.array(
+        [
+            [
+                (
+                    m.visibility,
+                    m.pos[0],
+                    m.pos[1],
+                    m.pos[2],
+                    m.pos_2d[0],  # 2d_x
+                    m.pos_2d[1],  # 2d_y
+                )
+                for m in (person[blaze_idx] for blaze_idx in _COCO_SOURCE_INDEX)
+            ]
+            for person in marks
+        ],
+        dtype=np.float64,
+    ).reshape(len(marks), len(_COCO_SOURCE_INDEX), _LANDMARK_COLS)
+    values[:, :, 2] *= -1  # Y軸は反転
+    return values
+
+
+def _iter_images(target_dir: Path) -> Iterator[tuple[Path, os.stat_result]]:
+    """
+    target_dir以下の画像ファイルを再帰的に列挙し、(パス, stat)を返す
+    os.scandirのエントリ情報を使うことで、ファイル毎のstat呼び出しを1回に抑える
+    (ディレクトリへのシンボリックリンクは辿らない)
+    """
+    stack: list[str] = [os.fspath(target_dir)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif (
+                    os.path.splitext(entry.name)[1].lower() in IMAGE_SUFFIXES
+                    and entry.is_file()
+                ):
+                    yield Path(entry.path), entry.stat()
 
 
 # ====== 並列処理用の初期化 ======
-_estimator: Estimate | None = None
+_estimator: Optional["Estimate"] = None
+
+
+def _worker_context() -> Optional[multiprocessing.context.BaseContext]:
+    """
+    ワーカープロセスの起動方法
+    Linuxではforkで起動し、ワーカー毎のモジュールの再importを省く
+    (forkした後にMediaPipeを初期化するため、親プロセスではモデルを読み込まないこと)
+    それ以外のプラットフォームでは既定(spawn)を使う
+    """
+    if sys.platform.startswith("linux"):
+        return multiprocessing.get_context("fork")
+    return None
 
 
-def _init_worker(model_path: str):
+def _init_worker(model_path: str, delegate: str):
+    from pose_estimate_blazepose import Estimate
+
     global _estimator
-    _estimator = Estimate(model_path, 3)
+    _estimator = Estimate(model_path, 3, delegate)
     _estimator.__enter__()  # コンテキストを開いたまま保持
+    # ワーカー終了時にコンテキストを閉じる
+    # (forkしたワーカーはos._exitで終了しatexitが呼ばれないため、
+    #  multiprocessingの終了処理に登録する)
+    multiprocessing.util.Finalize(
+        _estimator, _estimator.__exit__, args=(None, None, None), exitpriority=10
+    )
 
 
-def _estimate_proc(path: str) -> list[list[Landmark]]:
+def _estimate_proc(path: str) -> np.ndarray:
     global _estimator
     if _estimator is None:
         raise RuntimeError("Estimator not initialized in worker")
-    return _estimator.estimate(path)
+    # プロセス間で受け渡すのはLandmarkのリストではなく、射影済みの配列にする
+    # (ピクル化するオブジェクトを減らし、変換処理もワーカー側で行う)
+    return _pack_landmarks(_estimator.estimate(path))
+
+
+def _iter_tasks(
+    db: PoseDB,
+    candidates: list[tuple[Path, os.stat_result]],
+    index: FileIndex,
+    max_workers: int,
+    pbar: tqdm,
+) -> Iterator[ImageTask]:
+    """
+    ハッシュ値をスレッドで先行して計算し、推定が必要な画像を列挙順に返す
+    (推定と並行してハッシュ値を計算する)
+    登録済み(移動したファイル)や重複のため推定しない画像はpbarを進めておく
+    """
+    hash_executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pend_hash: set[bytes] = set()
+        checksums = hash_executor.map(
+            db.calc_hash,
+            (path for path, _ in candidates),
+            (stat for _, stat in candidates),
+        )
+        for (path, stat), checksum in zip(candidates, checksums):
+            task = db.check_imagefile(path, stat, checksum, index)
+            # 未登録の場合のみ推定を実行
+            if task is None:
+                pbar.update(1)
+                continue
+            if task.hash in pend_hash:
+                # 同一内容のファイルは1つだけ登録する
+                L.debug(f"duplicated file: {path}")
+                pbar.update(1)
+                continue
+            pend_hash.add(task.hash)
+            yield task
+    finally:
+        # 中断された場合は未着手のハッシュ計算を取り消す
+        hash_executor.shutdown(cancel_futures=True)
+
+
+def _store_result(db: PoseDB, future: Future, param: ImageTask) -> None:
+    """
+    推定結果(Future)を取得してデータベースに書き込む
+    """
+    from pose_estimate_blazepose import EstimateFailed
+
+    # _estimate_procの実行結果を取得
+    marks: Optional[np.ndarray] = None
+    try:
+        marks = future.result()
+    except EstimateFailed:
+        L.warning(f"Pose estimation failed for {param.path}. Skipping.")
+        # 推定に失敗した画像もファイルは登録しておく(再処理しない)
+        marks = _pack_landmarks([])
+    except Exception as exc:
+        # その他の予期せぬ例外 (未登録のまま残し、次回実行時に再処理する)
+        L.error(f"{param.path} generated an exception: {exc}")
+
+    if marks is not None:
+        try:
+            db.write_image_result(param, marks)
+        except Exception as exc:
+            L.error(f"{param.path} could not be written: {exc}")
 
 
 def process(
@@ -296,6 +615,8 @@ def process(
     init_db: bool,
     max_workers: int,
     use_partial_hash: bool,
+    durable: bool = False,
+    delegate: str = "cpu",
 ) -> bool:
     # モデルファイルの存在チェック
     if not model_path.exists():
@@ -323,60 +644,62 @@ def process(
 
     # PoseDB オブジェクトを初期化し、データベースファイルを開く
     # init_db が True の場合、初期化される
-    with PoseDB(database_path, init_db, use_partial_hash) as db:
+    with PoseDB(database_path, init_db, use_partial_hash, durable=durable) as db:
         # 処理対象のディレクトリ
         t_dir: Path = target_dir
 
         L.info("ファイルを列挙中...")
         # 指定されたディレクトリ (target_dir) 内のすべてのファイルを再帰的に検索し、
-        # ファイル名が .jpg または .jpeg で終わるもの（大文字小文字を区別しない）をリストアップ
-        image_paths = [
-            p
-            for p in t_dir.glob("**/*")
-            if re.search(R"\.(jpg|jpeg)$", str(p), re.IGNORECASE)
-        ]
+        # 拡張子が .jpg または .jpeg のもの（大文字小文字を区別しない）をリストアップ
+        image_paths = list(_iter_images(t_dir.absolute()))
         L.info(f"{len(image_paths)} ファイル検出")
 
         with ProcessPoolExecutor(
             max_workers=max_workers,
+            mp_context=_worker_context(),
             initializer=_init_worker,
-            initargs=(str(model_path),),
+            initargs=(str(model_path), delegate),
         ) as executor:
+            # forkで起動する場合、最初のsubmitで全ワーカーが起動する
+            # (ハッシュ計算用のスレッドを作る前にforkさせておく)
+            executor.submit(os.getpid)
+
             L.info("タスクの集計中...")
-            pend_task: list[ImageTask] = []
-            for path in tqdm(image_paths, desc="Registering files"):
-                path = path.absolute()
-                # 画像ファイルが既に登録されてるか確認
-                (b_id_created, image_id) = db.register_imagefile(path)
-                L.debug(f"fileId={image_id}")
-                # 新規登録された場合のみ推定を実行
-                if b_id_created:
-                    pend_task.append(ImageTask(path=path, image_id=image_id))
-            L.info(f"{len(pend_task)} タスク")
-
-            L.info("タスク生成中...")
-            futures: dict[any, ImageTask] = {}
-            for pt in pend_task:
-                futures[executor.submit(_estimate_proc, pt.path.as_posix())] = pt
-            L.info("完了")
-
-            # tqdmで進捗を表示しつつFutureを処理
-            for future in tqdm(
-                as_completed(futures), total=len(futures), desc="Processing images"
+            file_index = db.load_file_index()
+            db.find_vanished_files(file_index, t_dir, image_paths)
+            # サイズと更新時刻で登録済みと判断できないものだけハッシュ値を計算する
+            candidates = [
+                (path, stat)
+                for path, stat in image_paths
+                if db.needs_hash(path, stat, file_index)
+            ]
+            L.info(f"{len(candidates)} ファイルのハッシュ値を計算")
+
+            # 未完了のタスク数を制限しつつ投入し、完了したものから書き込む
+            max_pending = max_workers * PENDING_PER_WORKER
+            pending: dict[Future, ImageTask] = {}
+            n_done = 0
+            with (
+                tqdm(total=len(candidates), desc="Processing images") as pbar,
+                closing(
+                    _iter_tasks(db, candidates, file_index, max_workers, pbar)
+                ) as task_iter,
             ):
-                param = futures[future]
-
-                # _estimate_procの実行結果を取得
-                try:
-                    marks: list[list[Landmark]] = future.result()
-                    # 複数人物に対応するためループ処理
-                    for index, person_marks in enumerate(marks):
-                        db.write_landmarks(param.image_id, index, person_marks)
-                except EstimateFailed:
-                    L.warning(f"Pose estimation failed for {param.path}. Skipping.")
-                except Exception as exc:
-                    # その他の予期せぬ例外
-                    L.error(f"{param.path} generated an exception: {exc}")
+                while True:
+                    for pt in islice(task_iter, max_pending - len(pending)):
+                        pending[executor.submit(_estimate_proc, pt.path.as_posix())] = (
+                            pt
+                        )
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _store_result(db, future, pending.pop(future))
+                        pbar.update(1)
+                        n_done += 1
+                        # 一定数ごとにコミットし、中断時に処理済みの結果を失わないようにする
+                        if n_done % COMMIT_INTERVAL == 0:
+                            db.commit()
 
         db.commit()
     return True
@@ -391,6 +714,14 @@ def add_optional_arguments_to_parser(parser: argparse.ArgumentParser) -> None:
             default=False,
             help="Use partial hash instead of full hash",
         )
+    # コミット毎にfsyncするか(遅くなるが電源断に強い)
+    with suppress(argparse.ArgumentError):
+        parser.add_argument(
+            "--durable",
+            type=str_to_bool,
+            default=False,
+            help="Sync to disk on every commit (PRAGMA synchronous=FULL)",
+        )
     # SQLite3データベースファイル
     with suppress(argparse.ArgumentError):
         parser.add_argument(
@@ -423,6 +754,15 @@ def add_optional_arguments_to_parser(parser: argparse.ArgumentParser) -> None:
             default=os.cpu_count(),  # os.cpu_count() を使用してCPUコア数を取得
             help="Number of worker processes",
         )
+    # 推論に使うデバイス(GPUが使えない場合はCPUにフォールバックする)
+    with suppress(argparse.ArgumentError):
+        parser.add_argument(
+            "--delegate",
+            type=str,
+            choices=["cpu", "gpu"],
+            default="cpu",
+            help="Inference delegate of MediaPipe",
+        )
     # ロギング関連の引数を追加
     # --verbose や --quiet などのオプションが利用可能
     log.add_logging_args(parser)
@@ -450,4 +790,6 @@ if __name__ == "__main__":
         args.init_db,
         args.max_workers,
         args.use_partial_hash,
+        args.durable,
+        args.delegate,
     )
@@ -2,6 +2,7 @@ import argparse
 import logging as L
 from contextlib import suppress
 from pathlib import Path
+from typing import Iterable, Optional
 
 from common import log
 from common.argparse_aux import str_to_bool
@@ -13,13 +14,21 @@ from desc.tags import Table_Def, init_table_query
 from common.types import TableDef
 
 
+# add_tags_auto で一度に書き込む(poseId, タグ名)の件数
+TAG_BATCH_SIZE = 10000
+
+
 class TagsDB(Db):
+    # 登録済みタグ名 -> ID (未読み込みの場合はNone)
+    _tag_cache: Optional[dict[str, int]]
+
     def __init__(self, dbpath: str, clear_db: bool = False) -> None:
         """
         Args:
             dbpath (str): データベースファイルのパス
         """
         super().__init__(dbpath, clear_db, False)
+        self._tag_cache = None
 
     @property
     def init_query(self) -> str:
@@ -31,16 +40,35 @@ class TagsDB(Db):
         """テーブル定義"""
         return Table_Def
 
+    def _tag_ids(self) -> dict[str, int]:
+        """登録済みタグ名からIDへの対応 (初回のみTagInfoから読み込む)"""
+        if self._tag_cache is None:
+            self._tag_cache = dict(
+                self.cursor().execute("SELECT name, id FROM TagInfo")
+            )
+        return self._tag_cache
+
     def _register_tag(self, name: str) -> int:
         """タグ名を登録し、そのIDを返す"""
-        cursor = self.cursor()
-        cursor.execute("SELECT id FROM TagInfo WHERE name=?", (name,))
-        id_row = cursor.fetchone()
-        if id_row is None:
+        tag_ids = self._tag_ids()
+        tag_id = tag_ids.get(name)
+        if tag_id is None:
+            cursor = self.cursor()
             cursor.execute("INSERT INTO TagInfo(name) VALUES (?)", (name,))
-            return cursor.lastrowid
-        assert isinstance(id_row[0], int)
-        return id_row[0]
+            tag_id = tag_ids[name] = cursor.lastrowid
+        return tag_id
+
+    def _register_tags(self, names: Iterable[str]) -> dict[str, int]:
+        """複数のタグ名をまとめて登録し、タグ名からIDへの対応を返す"""
+        tag_ids = self._tag_ids()
+        new_names = [n for n in names if n not in tag_ids]
+        if len(new_names) > 0:
+            cursor = self.cursor()
+            cursor.executemany(
+                "INSERT INTO TagInfo(name) VALUES (?)", ((n,) for n in new_names)
+            )
+            tag_ids.update(cursor.execute("SELECT name, id FROM TagInfo"))
+        return tag_ids
 
     def add_tags_auto(self, tag_root: str) -> None:
         # tag_rootをPathに変換し、それが有効なディレクトリか判定
@@ -58,29 +86,64 @@ class TagsDB(Db):
                 ON Pose.fileId = File.id
             """
         )
-        exec_l: list[tuple[int, int]] = []
-        while True:
-            ent = cursor.fetchone()
-            if ent is None:
-                break
-            pose_id: int = ent[0]
-            file_path = Path(ent[1])
+        # (poseId, タグ名) (TAG_BATCH_SIZE件ごとに書き込み、メモリ使用量を抑える)
+        pose_tags: list[tuple[int, str]] = []
+        for pose_id, path in cursor:
+            file_path = Path(path)
             try:
                 # tag_root_pathを基準に相対パスを構築
                 file_path = file_path.relative_to(tag_root_path)
-                for i in range(len(file_path.parts) - 1):
-                    tag_name = file_path.parts[i]
-                    tag_id = self._register_tag(tag_name)
-                    exec_l.append((pose_id, tag_id))
             except ValueError:
                 # 無効なファイルパス
-                pass
-        if len(exec_l) > 0:
-            cursor2 = self.cursor()
-            cursor2.executemany(
-                "INSERT INTO Tags (poseId, tagId) VALUES (?, ?)",
-                exec_l,
+                continue
+            # ディレクトリ名をタグとする (ファイル名は除く)
+            pose_tags.extend((pose_id, name) for name in file_path.parts[:-1])
+            if len(pose_tags) >= TAG_BATCH_SIZE:
+                self._insert_pose_tags(pose_tags)
+                pose_tags.clear()
+        self._insert_pose_tags(pose_tags)
+
+    def _insert_pose_tags(self, pose_tags: list[tuple[int, str]]) -> None:
+        """(poseId, タグ名)のリストをまとめて書き込む"""
+        if len(pose_tags) == 0:
+            return
+        # タグ名は出現順にまとめて登録する
+        tag_ids = self._register_tags(dict.fromkeys(name for _, name in pose_tags))
+        # (読み込み中のカーソルとは別のカーソルで書き込む)
+        self.cursor().executemany(
+            "INSERT INTO Tags (poseId, tagId) VALUES (?, ?)",
+            ((pose_id, tag_ids[name]) for pose_id, name in pose_tags),
+        )
+
+    def _create_path_segment(self) -> None:
+        """
+        ファイルパスをディレクトリ名毎に分割した一時テーブル(PathSegment)を作成する
+        (タグ毎にFile.pathをLIKEで全件走査しないようにするため)
+        """
+        cursor = self.cursor()
+        cursor.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS PathSegment (
+                fileId  INTEGER NOT NULL,
+                -- LIKEと同様に大文字小文字を区別しない
+                seg     TEXT NOT NULL COLLATE NOCASE
             )
+            """
+        )
+        cursor.execute("DELETE FROM PathSegment")
+        # ファイル名を除いたディレクトリ名のみ (同じ名前はファイル毎に1つにまとめる)
+        cursor.executemany(
+            "INSERT INTO PathSegment(fileId, seg) VALUES (?, ?)",
+            (
+                (file_id, seg)
+                for file_id, path in self.cursor().execute("SELECT id, path FROM File")
+                for seg in set(path.split("/")[:-1])
+                if seg
+            ),
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_path_segment ON PathSegment(seg)"
+        )
 
     def add_tags(self, tags: list[tuple[str, str]]) -> None:
         """
@@ -89,33 +152,41 @@ class TagsDB(Db):
         Args:
             tags (list[tuple[str, str]]): ディレクトリ名とタグ名のペアのリスト
         """
+        if len(tags) == 0:
+            return
+        self._create_path_segment()
         cursor = self.cursor()
         for tag in tags:
             dir_name, tag_name = tag
             tag_id = self._register_tag(tag_name)
 
-            # タグに合致するファイルパスを持つ画像を一括取得
-            cursor.execute(
-                """
-                SELECT Pose.id
-                FROM Pose
-                INNER JOIN File
-                    ON Pose.fileId = File.id
-                WHERE File.path LIKE ? OR File.path LIKE ?
-                """,
-                (f"%/{dir_name}/%", f"{dir_name}/%"),
-            )
-            res_a = cursor.fetchall()
-            if len(res_a) == 0:
-                # 該当なし
-                continue
-
-            exec_l: list[tuple[int, int]] = []
-            for res in res_a:
-                pose_id: int = res[0]
-                exec_l.append((pose_id, tag_id))
-
-            cursor.executemany("INSERT INTO Tags VALUES (?,?)", exec_l)
+            # タグに合致するファイルパスを持つ画像を一括でタグ付けする
+            # (Pythonを経由せずSQLite内で完結させる)
+            if "/" in dir_name:
+                # 複数階層の指定はディレクトリ名単位で引けないのでパスを走査する
+                cursor.execute(
+                    """
+                    INSERT INTO Tags (poseId, tagId)
+                    SELECT Pose.id, ?
+                    FROM Pose
+                    INNER JOIN File
+                        ON Pose.fileId = File.id
+                    WHERE File.path LIKE ? OR File.path LIKE ?
+                    """,
+                    (tag_id, f"%/{dir_name}/%", f"{dir_name}/%"),
+                )
+            else:
+                cursor.execute(
+                    """
+                    INSERT INTO Tags (poseId, tagId)
+                    SELECT Pose.id, ?
+                    FROM PathSegment
+                    INNER JOIN Pose
+                        ON Pose.fileId = PathSegment.fileId
+                    WHERE PathSegment.seg = ?
+                    """,
+                    (tag_id, dir_name),
+                )
 
 
 class ExtendAction(argparse.Action):
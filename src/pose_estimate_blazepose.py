@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import logging as L
 import os
 from typing import Any
 
@@ -10,6 +11,12 @@ from PIL import Image, ImageOps
 from common.constants import BLAZEPOSE_LANDMARK_LEN
 from landmark_blazepose import Landmark
 
+# MediaPipeのクラスはモジュール読み込み時に一度だけ参照する
+_BaseOptions = mp.tasks.BaseOptions
+_PoseLandmarker = mp.tasks.vision.PoseLandmarker
+_PoseLandmarkerOptions = mp.tasks.vision.PoseLandmarkerOptions
+_RunningMode = mp.tasks.vision.RunningMode
+
 
 class EstimateFailed(Exception):
     pass
@@ -25,18 +32,39 @@ class Estimate:
     poseLandmarker: Any
     options: Any
 
-    def __init__(self, model_path: str, num_poses: int = 1):
+    # 大きなJPEGはデコード時に1/2, 1/4, 1/8へ縮小する
+    # (縦横ともにこの値を下回らない範囲で縮小される)
+    DECODE_MIN_SIZE = 1024
+
+    # 推論に使うデリゲートの指定値
+    DELEGATES = ("cpu", "gpu")
+
+    def __init__(self, model_path: str, num_poses: int = 1, delegate: str = "cpu"):
         """
         Pose Landmarkerの初期化
         指定されたモデルファイルを使用し、画像モードで一度に指定数のポーズを検出するように設定
+        delegateに"gpu"を指定した場合はGPUで推論する
+        (GPU対応のMediaPipeでない場合などは、__enter__でCPUにフォールバックする)
         """
-        baseOptions = mp.tasks.BaseOptions
-        self.poseLandmarker = mp.tasks.vision.PoseLandmarker
-        poseLandmarkerOptions = mp.tasks.vision.PoseLandmarkerOptions
-        visionRunningMode = mp.tasks.vision.RunningMode
-        self.options: mp.tasks.vision.PoseLandmarkerOptions = poseLandmarkerOptions(
-            base_options=baseOptions(model_asset_path=model_path),
-            running_mode=visionRunningMode.IMAGE,
+        if delegate not in self.DELEGATES:
+            raise ValueError(f"Unknown delegate: {delegate}")
+        self.poseLandmarker = _PoseLandmarker
+        self.options = self._make_options(model_path, num_poses, delegate)
+
+    @staticmethod
+    def _make_options(
+        model_path: str, num_poses: int, delegate: str
+    ) -> mp.tasks.vision.PoseLandmarkerOptions:
+        return _PoseLandmarkerOptions(
+            base_options=_BaseOptions(
+                model_asset_path=model_path,
+                delegate=(
+                    _BaseOptions.Delegate.GPU
+                    if delegate == "gpu"
+                    else _BaseOptions.Delegate.CPU
+                ),
+            ),
+            running_mode=_RunningMode.IMAGE,
             num_poses=num_poses,
         )
 
@@ -45,7 +73,18 @@ class Estimate:
         コンテキストマネージャーのエントリポイント
         Pose Landmarkerインスタンスを作成し返す
         """
-        self.landmarker = self.poseLandmarker.create_from_options(self.options)
+        try:
+            self.landmarker = self.poseLandmarker.create_from_options(self.options)
+        except Exception as e:
+            base = self.options.base_options
+            if base.delegate != _BaseOptions.Delegate.GPU:
+                raise
+            # GPUデリゲートが使えない環境ではCPUで推論する
+            L.warning(f"GPU delegate is not available ({e}). Falling back to CPU")
+            self.options = self._make_options(
+                base.model_asset_path, self.options.num_poses, "cpu"
+            )
+            self.landmarker = self.poseLandmarker.create_from_options(self.options)
         return self
 
     def __exit__(self, e_type, e_val, e_tb) -> None:
@@ -63,10 +102,14 @@ class Estimate:
         """
         try:
             with Image.open(img_path) as img:
+                # JPEGの場合はDCT領域で縮小してデコードし、デコード量と転送量を減らす
+                # (モデルの入力は256x256程度であり、2D座標も画像サイズに対する正規化値)
+                img.draft("RGB", (Estimate.DECODE_MIN_SIZE, Estimate.DECODE_MIN_SIZE))
                 # EXIFの回転を適用（EXIFがない場合はそのまま）
                 img = ImageOps.exif_transpose(img)
                 # MediaPipeはRGBを期待
-                img = img.convert("RGB")
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
                 np_img = np.asarray(img)
         except Exception as e:
             raise EstimateFailed(f"画像読み込みに失敗しました: {e}")
@@ -1,4 +1,5 @@
 import argparse
+from contextlib import closing
 from pathlib import Path
 
 from common.constants import CocoLandmark
@@ -32,88 +33,45 @@ class ReliabilityDB(Db):
         PoseId毎に(Face, Half)のReliabilityを算出
         信頼性=(confidence値の二乗)の平均
         """
-        base_query = """
-             SELECT Pose.id, AVG(lm.confidence*lm.confidence) FROM Pose
-             JOIN Landmark AS lm ON lm.poseId = Pose.id
-             WHERE {}
-             GROUP BY Pose.id
-             ORDER BY Pose.id ASC
-        """
-
-        cursor = self.cursor()
-        # 顔の信頼性を計算
-        cursor.execute(
-            base_query.format(
-                "landmarkIndex <= {}".format(CocoLandmark.right_ear.value)
-            )
-        )
-        face_reliability_data: list[tuple[int, float]] = cursor.fetchall()
-        # 左半身の信頼性を計算
-        cursor.execute(
-            base_query.format(
-                "landmarkIndex IN ({}, {}, {}, {})".format(
-                    CocoLandmark.left_shoulder.value,
-                    CocoLandmark.left_elbow.value,
-                    CocoLandmark.left_knee.value,
-                    CocoLandmark.left_ankle.value,
-                )
-            )
-        )
-        left_half_reliability_data: list[tuple[int, float]] = cursor.fetchall()
-        # 右半身の信頼性を計算
-        cursor.execute(
-            base_query.format(
-                "landmarkIndex IN ({}, {}, {}, {})".format(
-                    CocoLandmark.right_shoulder.value,
-                    CocoLandmark.right_elbow.value,
-                    CocoLandmark.right_knee.value,
-                    CocoLandmark.right_ankle.value,
-                )
+        face = ",".join(str(i) for i in range(CocoLandmark.right_ear.value + 1))
+        left = ",".join(
+            str(lm.value)
+            for lm in (
+                CocoLandmark.left_shoulder,
+                CocoLandmark.left_elbow,
+                CocoLandmark.left_knee,
+                CocoLandmark.left_ankle,
             )
         )
-        right_half_reliability_data: list[tuple[int, float]] = cursor.fetchall()
-
-        # 集約関数を使っているので、各リストの長さはポーズの数と一致するはず
-        assert (
-            len(face_reliability_data)
-            == len(left_half_reliability_data)
-            == len(right_half_reliability_data)
-        )
-
-        reliability_data_to_write: list[tuple[int, float, float]] = []
-        # 各ポーズの信頼性を集計
-        for face_data, left_data, right_data in zip(
-            face_reliability_data,
-            left_half_reliability_data,
-            right_half_reliability_data,
-        ):
-            pose_id = face_data[0]
-            # ソート済みの筈なのでポーズIdは一緒
-            assert pose_id == left_data[0] == right_data[0]
-            reliability_data_to_write.append(
-                (
-                    pose_id,  # poseId
-                    min(
-                        left_data[1], right_data[1]
-                    ),  # torso_half_min (左右の信頼性の最小値)
-                    face_data[1],  # face_detect (顔の信頼性)
-                )
+        right = ",".join(
+            str(lm.value)
+            for lm in (
+                CocoLandmark.right_shoulder,
+                CocoLandmark.right_elbow,
+                CocoLandmark.right_knee,
+                CocoLandmark.right_ankle,
             )
-
-        # 一旦古い情報を削除
-        cursor.execute(
-            """
-            DELETE FROM Reliability
-            WHERE poseId IN (SELECT id FROM Pose)
-            """
-        )
-        # 計算した信頼性値をデータベースに書き込む
-        cursor.executemany(
-            """
-            INSERT INTO Reliability VALUES(?,?,?)
-            """,
-            reliability_data_to_write,
         )
+        # Landmarkを1回走査し、部位毎の集計をFILTERで分けて求める
+        # 計算した信頼性値をデータベースに書き込む(既存のposeIdは更新)
+        query = f"""
+            INSERT INTO Reliability(poseId, torsoHalfMin, faceDetect)
+            SELECT
+                poseId,
+                -- torso_half_min (左右の信頼性の最小値)
+                min(
+                    AVG(confidence*confidence) FILTER (WHERE landmarkIndex IN ({left})),
+                    AVG(confidence*confidence) FILTER (WHERE landmarkIndex IN ({right}))
+                ),
+                -- face_detect (顔の信頼性)
+                AVG(confidence*confidence) FILTER (WHERE landmarkIndex IN ({face}))
+            FROM Landmark
+            GROUP BY poseId
+            ON CONFLICT(poseId) DO UPDATE
+            SET torsoHalfMin=excluded.torsoHalfMin, faceDetect=excluded.faceDetect
+        """
+        with self.transaction(), closing(self.cursor()) as cursor:
+            cursor.execute(query)
 
 
 def process(database_path: Path, init_db: bool) -> None:
@@ -1,36 +1,60 @@
 import argparse
 import logging
-import sys
 from contextlib import closing
-from dataclasses import dataclass
 from pathlib import Path
 
+import numpy as np
+
 from common.constants import CocoLandmark as CLm
 from common.db_readwrite import add_optional_arguments_to_parser
 from common.log import apply_logging_option
-from common.serialize import vec_serialize
+from common.serialize import vec_serialize_int8_rows
 from common.types import TableDef
 from common.vec_db import VecDb
 from desc.spinedir import Table_Def, init_table_query
 
 
-@dataclass
-class DirRow:
-    pose_id: int
-    x: float
-    y: float
-    z: float
-
-
-@dataclass
-class VecRow:
-    pose_id: int
-    dir_bytes: bytes
+# 腰・肩の中心から背骨の向きを算出し、MasseSpineDirへUPSERTするクエリ
+# (書き込んだ値はRETURNINGで受け取り、MasseSpineVecの書き込みに使う)
+_SPINE_DIR_SQL = """
+    WITH Vec AS (
+        SELECT
+            lh.poseId,
+            -- 肩の中心 - 腰の中心
+            (ls.x + rs.x) / 2 - (lh.x + rh.x) / 2 AS vx,
+            (ls.y + rs.y) / 2 - (lh.y + rh.y) / 2 AS vy,
+            (ls.z + rs.z) / 2 - (lh.z + rh.z) / 2 AS vz
+        FROM Landmark AS lh
+        -- 4点が揃っているポーズのみ対象 (データ不足は除外)
+        JOIN Landmark AS rh
+            ON rh.poseId = lh.poseId AND rh.landmarkIndex = :right_hip
+        JOIN Landmark AS ls
+            ON ls.poseId = lh.poseId AND ls.landmarkIndex = :left_shoulder
+        JOIN Landmark AS rs
+            ON rs.poseId = lh.poseId AND rs.landmarkIndex = :right_shoulder
+        WHERE lh.landmarkIndex = :left_hip
+    ),
+    VecLen AS (
+        SELECT poseId, vx, vy, vz, sqrt(vx*vx + vy*vy + vz*vz) AS len
+        FROM Vec
+    )
+    INSERT INTO MasseSpineDir (poseId, x, y, z)
+    -- 正規化 (長さ0のものは除外)
+    SELECT poseId, vx / len, vy / len, vz / len
+    FROM VecLen
+    WHERE len > 0
+    ON CONFLICT(poseId) DO UPDATE
+    SET x=excluded.x, y=excluded.y, z=excluded.z
+    RETURNING poseId, x, y, z
+"""
 
 
 class SpineDirDB(VecDb):
+    # 背骨の向きはランドマークから再計算できるので、旧定義のテーブルは作り直す
+    REBUILD_ON_SCHEMA_MISMATCH = True
+
     def __init__(self, dbpath: str, clear_table: bool) -> None:
-        super().__init__(dbpath, clear_table, row_name=True)
+        super().__init__(dbpath, clear_table)
         self._logger = logging.getLogger(__name__)
 
     @property
@@ -42,116 +66,44 @@ class SpineDirDB(VecDb):
         return Table_Def
 
     def calculate(self) -> None:
-        with closing(self.cursor()) as cur:
-            # PoseId列挙
-            cur.execute("SELECT id FROM Pose")
-            pose_ids: list[int] = [row[0] for row in cur.fetchall()]
-            total = len(pose_ids)
+        # 全ポーズ分の書き込みを1つのトランザクションにまとめる
+        # (MasseSpineDirとMasseSpineVecが食い違った状態で残らないようにする)
+        with self.transaction(), closing(self.cursor()) as cur:
+            total: int = cur.execute("SELECT COUNT(*) FROM Pose").fetchone()[0]
             print(f"[INFO] {total} poses found. Start calculation...")
 
-            dir_rows: list[DirRow] = []
-            vec_rows: list[VecRow] = []
-
-            for idx, pose_id in enumerate(pose_ids, start=1):
-                # 必要なランドマークを取り出す
-                cur.execute(
-                    """
-                    SELECT landmarkIndex, x, y, z
-                    FROM Landmark
-                    WHERE poseId = ?
-                      AND landmarkIndex IN (?, ?, ?, ?)
-                    """,
-                    (
-                        pose_id,
-                        CLm.left_hip.value,
-                        CLm.right_hip.value,
-                        CLm.left_shoulder.value,
-                        CLm.right_shoulder.value,
-                    ),
-                )
-                rows: list[tuple[int, float, float, float]] = cur.fetchall()
-                if len(rows) != 4:
-                    # 警告ログを出力
-                    found_indices = {r[0] for r in rows}
-                    expected_indices = {
-                        CLm.left_hip.value,
-                        CLm.right_hip.value,
-                        CLm.left_shoulder.value,
-                        CLm.right_shoulder.value,
-                    }
-                    missing = sorted(expected_indices - found_indices)
-                    self._logger.warning(
-                        "Pose %d: insufficient landmark data (%d/4). Missing indices: %s. Skipped.",
-                        pose_id,
-                        len(rows),
-                        missing,
-                    )
-                    continue
-
-                lm: dict[int, tuple[float, float, float]] = {
-                    idx: (x, y, z) for idx, x, y, z in rows
-                }
-
-                # 腰と肩の中心
-                hip_center: tuple[float, float, float] = (
-                    (lm[CLm.left_hip.value][0] + lm[CLm.right_hip.value][0]) / 2,
-                    (lm[CLm.left_hip.value][1] + lm[CLm.right_hip.value][1]) / 2,
-                    (lm[CLm.left_hip.value][2] + lm[CLm.right_hip.value][2]) / 2,
+            # 取得・計算・MasseSpineDirへの保存(UPSERT)までをSQLite内で一括実行する
+            dir_rows: list[tuple[int, float, float, float]] = cur.execute(
+                _SPINE_DIR_SQL,
+                {
+                    "left_hip": CLm.left_hip.value,
+                    "right_hip": CLm.right_hip.value,
+                    "left_shoulder": CLm.left_shoulder.value,
+                    "right_shoulder": CLm.right_shoulder.value,
+                },
+            ).fetchall()
+            if len(dir_rows) < total:
+                self._logger.warning(
+                    "%d poses have insufficient landmark data"
+                    " or a zero-length spine vector. Skipped.",
+                    total - len(dir_rows),
                 )
-                shoulder_center: tuple[float, float, float] = (
-                    (lm[CLm.left_shoulder.value][0] + lm[CLm.right_shoulder.value][0]) / 2,
-                    (lm[CLm.left_shoulder.value][1] + lm[CLm.right_shoulder.value][1]) / 2,
-                    (lm[CLm.left_shoulder.value][2] + lm[CLm.right_shoulder.value][2]) / 2,
-                )
-
-                # ベクトル計算
-                dx = shoulder_center[0] - hip_center[0]
-                dy = shoulder_center[1] - hip_center[1]
-                dz = shoulder_center[2] - hip_center[2]
-                norm = (dx * dx + dy * dy + dz * dz) ** 0.5
-                if norm == 0:
-                    # 警告ログを出力
-                    self._logger.warning(
-                        "Pose %d: spine direction vector norm is zero. Skipped.",
-                        pose_id,
-                    )
-                    continue
-                dx /= norm
-                dy /= norm
-                dz /= norm
-
-                # バッチ用に追加
-                dir_rows.append(DirRow(pose_id, dx, dy, dz))
-                vec_rows.append(VecRow(pose_id, vec_serialize([dx, dy, dz])))
-
-                # 進捗表示
-                if idx % 50 == 0 or idx == total:
-                    percent = (idx / total) * 100
-                    print(
-                        f"[PROGRESS] {idx}/{total} ({percent:.1f}%) processed",
-                        file=sys.stderr,
-                    )
-
-            # MasseSpineDirへ保存（UPSERT）
-            cur.executemany(
-                """
-                INSERT INTO MasseSpineDir(poseId, x, y, z)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(poseId) DO UPDATE SET x=excluded.x, y=excluded.y, z=excluded.z
-                """,
-                [(r.pose_id, r.x, r.y, r.z) for r in dir_rows],
-            )
 
             # MasseSpineVecへ保存（vec0 用）
-            # 既存のposeIdがあれば削除
+            # vec0(仮想テーブル)はUPSERTに対応していないので、既存のposeIdを削除してから書き込む
+            # (poseIdは主キーなので、1件ずつの削除でも索引で引ける)
             cur.executemany(
                 "DELETE FROM MasseSpineVec WHERE poseId = ?",
-                [(r.pose_id,) for r in dir_rows],
+                ((pose_id,) for pose_id, *_ in dir_rows),
             )
-            # 新規INSERT
+            # 新規INSERT (方向ベクトルは全件まとめて量子化する)
+            dirs = np.array(dir_rows, dtype=np.float64).reshape(-1, 4)[:, 1:]
             cur.executemany(
-                "INSERT INTO MasseSpineVec(poseId, dir) VALUES (?, ?)",
-                [(r.pose_id, r.dir_bytes) for r in vec_rows],
+                "INSERT INTO MasseSpineVec(poseId, dir) VALUES (?, vec_int8(?))",
+                zip(
+                    (pose_id for pose_id, *_ in dir_rows),
+                    vec_serialize_int8_rows(dirs),
+                ),
             )
 
             print(f"[INFO] Calculation finished. {len(dir_rows)} entries updated.")
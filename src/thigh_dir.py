@@ -7,23 +7,28 @@ from common.db_readwrite import add_optional_arguments_to_parser, calc_landmark_
 from common.log import apply_logging_option
 from common.types import TableDef
 from common.vec_db import Db
-from desc.thigh_dir import Table_Def, init_table_query
+from desc.thigh_dir import Table_Def, index_query, init_table_query
 
 
 class ThighDirDB(Db):
     def __init__(self, dbpath: str, clear_table: bool):
-        super().__init__(dbpath, clear_table, row_name=True)
+        super().__init__(dbpath, clear_table)
 
     @property
     def init_query(self) -> str:
         return init_table_query()
 
+    @property
+    def index_query(self) -> str:
+        return index_query()
+
     @property
     def table_def(self) -> TableDef:
         return Table_Def
 
     def calculate(self):
-        with closing(self.cursor()) as cur:
+        # 全ポーズ分の書き込みを1つのトランザクションにまとめる
+        with self.transaction(), closing(self.cursor()) as cur:
             calc_landmark_dir(
                 cur,
                 (
@@ -32,6 +37,8 @@ class ThighDirDB(Db):
                 ),
                 "MasseThighDir",
             )
+            # 結合時にカバリングインデックスが選ばれるよう統計情報を更新しておく
+            cur.execute("ANALYZE MasseThighDir")
 
 
 def process(database_path: Path, init_db: bool) -> None:
@@ -2,22 +2,145 @@
 
 import argparse
 import logging as L
+import sqlite3
 from pathlib import Path
-from typing import Optional
+from typing import Iterator
 
 import numpy as np
 
-from common.constants import COCO_LANDMARK_LEN
 from common.constants import CocoLandmark as CLm
 from common.db_readwrite import add_optional_arguments_to_parser
 from common.log import apply_logging_option
-from common.serialize import vec_deserialize, vec_serialize
+from common.serialize import (
+    vec_serialize_int8,
+    vec_serialize_int8_rows,
+)
 from common.types import TableDef
 from common.vec_db import VecDb
 from desc.torsodir import Table_Def, init_table_query
 
 
+# 胴体の向きの算出に使うランドマーク (landmarkIndexの昇順)
+_TORSO_LANDMARKS: tuple[int, ...] = (
+    CLm.left_shoulder.value,
+    CLm.right_shoulder.value,
+    CLm.left_hip.value,
+    CLm.right_hip.value,
+)
+assert list(_TORSO_LANDMARKS) == sorted(_TORSO_LANDMARKS)
+_LS, _RS, _LH, _RH = range(len(_TORSO_LANDMARKS))
+
+# 計算に使えると判断するランドマークの信頼度
+TH_PRESENCE = 0.9
+
+# ランドマークの読み込み時に一度に取り出す行数 (ポーズ数の4倍になるようにする)
+_FETCH_ROWS = len(_TORSO_LANDMARKS) * 8192
+
+# 胴体の向きの算出方法と、それに必要なランドマーク (優先順)
+_TORSO_METHODS: tuple[str, ...] = (
+    "4pt: Both(Hip, Shoulder)",
+    "3pt: (Both(Shoulder), LH))",
+    "3pt: (Both(Shoulder), RH)",
+    "3pt: (LS, Both(Hip))",
+    "3pt: (RS, Both(Hip))",
+    "2pt: (LS, RH)",
+    "2pt: (LH, RS)",
+)
+_TORSO_METHOD_REQUIRES: tuple[tuple[int, ...], ...] = (
+    (_LS, _RS, _LH, _RH),
+    (_LS, _RS, _LH),
+    (_LS, _RS, _RH),
+    (_LH, _RH, _LS),
+    (_LH, _RH, _RS),
+    (_LS, _RH),
+    (_LH, _RS),
+)
+
+
+def _method_table() -> np.ndarray:
+    """
+    使えるランドマークのビットマスク(_TORSO_LANDMARKSの順に1ビットずつ)から
+    算出方法(_TORSO_METHODSの添字、算出できない場合は-1)を引く表を作成する
+    """
+    table = np.full(1 << len(_TORSO_LANDMARKS), -1, dtype=np.int8)
+    for mask in range(len(table)):
+        for i, requires in enumerate(_TORSO_METHOD_REQUIRES):
+            if all(mask & (1 << r) for r in requires):
+                table[mask] = i
+                break
+    return table
+
+
+_METHOD_FOR_MASK: np.ndarray = _method_table()
+
+
+def _norm(v: np.ndarray) -> np.ndarray:
+    """(N, D)のベクトルの行毎の長さ (np.linalg.normより軽いeinsumで計算する)"""
+    return np.sqrt(np.einsum("ij,ij->i", v, v))
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    """(N, 3)のベクトルを行毎に正規化する"""
+    return v / _norm(v)[:, None]
+
+
+def _calc_torso_dir(
+    pos: np.ndarray, present: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    全ポーズ分の胴体の向きをまとめて算出する
+
+    Args:
+        pos (np.ndarray): (N, 4, 3) 肩・腰の座標 (_TORSO_LANDMARKSの順)
+        present (np.ndarray): (N, 4) 計算に使えるランドマークか
+
+    Returns:
+        ((N, 3)の向き(posと同じdtype), (N,)の算出方法(_TORSO_METHODSの添字、算出できない場合は-1))
+    """
+    posLS, posRS, posLH, posRH = (pos[:, i] for i in (_LS, _RS, _LH, _RH))
+    n = len(pos)
+
+    # 全ポーズについて各方法の候補を計算し、使えるもののうち優先度の高いものを選ぶ
+    # (使われない候補では長さ0になり得るので、その警告は抑制する)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dir_vA = _normalize(np.cross(posLH - posLS, posRS - posLS))
+        dir_vB = _normalize(np.cross(posLS - posRS, posRH - posRS))
+        # 2点(対角線)の場合は、左右の位置関係から奥行き方向の基準を決める
+        base_z_LS_RH = np.zeros((n, 3), dtype=pos.dtype)
+        base_z_LS_RH[:, 2] = np.where(posLS[:, 0] < posRH[:, 0], 1, -1)
+        base_z_LH_RS = np.zeros((n, 3), dtype=pos.dtype)
+        base_z_LH_RS[:, 2] = np.where(posLH[:, 0] < posRS[:, 0], 1, -1)
+        # _TORSO_METHODSの順に並べた候補 (方法数, N, 3)
+        candidates = np.stack(
+            (
+                # 4点
+                _normalize(dir_vA + dir_vB),
+                # 両方の肩と片方のヒップ
+                dir_vA,
+                dir_vB,
+                # 両方のヒップと片方の肩
+                _normalize(-np.cross(posLS - posLH, posRH - posLH)),
+                _normalize(np.cross(posRS - posRH, posLH - posRH)),
+                # 対角線
+                _normalize(np.cross(posRH - posLS, base_z_LS_RH)),
+                _normalize(np.cross(posLH - posRS, base_z_LH_RS)),
+            )
+        )
+
+    # 使えるランドマークをuint8のビットマスクにまとめ、表引きで算出方法を決める
+    bits = (1 << np.arange(len(_TORSO_LANDMARKS))).astype(np.uint8)
+    mask = np.bitwise_or.reduce(present * bits, axis=1)
+    method_idx = _METHOD_FOR_MASK[mask].astype(np.intp)
+    dir_v = np.zeros((n, 3), dtype=pos.dtype)
+    valid = method_idx >= 0
+    dir_v[valid] = candidates[method_idx[valid], np.flatnonzero(valid)]
+    return dir_v, method_idx
+
+
 class MasseTorsoDB(VecDb):
+    # 胴体の向きはランドマークから再計算できるので、旧定義のテーブルは作り直す
+    REBUILD_ON_SCHEMA_MISMATCH = True
+
     def __init__(self, dbpath: str, clear_table: bool):
         super().__init__(dbpath, clear_table, row_name=True)
 
@@ -30,19 +153,8 @@ class MasseTorsoDB(VecDb):
         return Table_Def
 
     def _test_fetch_vec(self, dir_v: list[float], limit: int) -> None:
-        cur = self.cursor()
-        cur.execute(
-            """
-            SELECT poseId, dir, distance FROM MasseTorsoVec
-            WHERE dir MATCH ?
-            ORDER BY distance
-            LIMIT ?
-                """,
-            (vec_serialize(dir_v), limit),
-        )
-        for ent in cur.fetchall():
-            deserialized_torsoDir = vec_deserialize(ent["dir"])
-            print(f"Distance: {ent['distance']}, TorsoDir: {deserialized_torsoDir}")
+        for ent in self.knn("MasseTorsoVec", "dir", dir_v, limit):
+            print(f"Distance: {ent['distance']}, PoseId: {ent['poseId']}")
 
     def _test_fetch_vec2(self, dir_v: list[float], limit: int) -> None:
         cur = self.cursor()
@@ -51,9 +163,7 @@ class MasseTorsoDB(VecDb):
             WITH knn_match AS (
                 SELECT poseId, dir, distance
                 FROM MasseTorsoVec
-                WHERE dir MATCH ?
-                ORDER BY distance
-                LIMIT ?
+                WHERE dir MATCH vec_int8(?) AND k = ?
             )
             SELECT pose.id, knn.distance, file.path, mt.x, mt.y, mt.z, mt.method, mt.score
             FROM MasseTorsoDir AS mt
@@ -66,7 +176,7 @@ class MasseTorsoDB(VecDb):
             WHERE mt.score >= 0.5
             ORDER BY distance ASC
             """,
-            (vec_serialize(dir_v), limit),
+            (vec_serialize_int8(dir_v), limit),
         )
         for ent in cur.fetchall():
             print(
@@ -77,223 +187,163 @@ class MasseTorsoDB(VecDb):
                 ent["distance"],
             )
 
+    def _load_torso_landmarks(
+        self, cur: sqlite3.Cursor
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        全ポーズの肩・腰のランドマークと信頼度を1回のクエリでまとめて読み込む
+
+        Returns:
+            (poseIdの配列, (ポーズ数, 4, 3)のfloat32の座標配列, (ポーズ数, 4)の信頼度, torsoHalfMinの配列)
+            ランドマークは_TORSO_LANDMARKSの順に並ぶ
+        """
+        cur.execute(
+            f"""
+            SELECT l.poseId, l.landmarkIndex, l.x, l.y, l.z, l.confidence,
+                   r.torsoHalfMin
+            FROM Landmark AS l
+            LEFT JOIN Reliability AS r
+                ON r.poseId = l.poseId
+            WHERE l.landmarkIndex IN ({",".join("?" * len(_TORSO_LANDMARKS))})
+            ORDER BY l.poseId, l.landmarkIndex
+            """,
+            _TORSO_LANDMARKS,
+        )
+        # 結果は一定行数ずつ取り出してすぐ配列化し、全行分のタプルのリストを溜め込まない
+        # (torsoHalfMinがNULLの場合はNaN)
+        cur.arraysize = _FETCH_ROWS
+        chunks = [np.empty((0, 7))]
+        while rows := cur.fetchmany():
+            chunks.append(np.array(rows, dtype=np.float64))
+        # (ポーズ数, 4, 列数) に並べ直す
+        rows = np.concatenate(chunks).reshape(-1, len(_TORSO_LANDMARKS), 7)
+        assert (rows[:, :, 0] == rows[:, :1, 0]).all() and (
+            rows[:, :, 1] == _TORSO_LANDMARKS
+        ).all(), "Each pose must have all torso landmarks"
+        return (
+            rows[:, 0, 0].astype(np.int64),
+            # 座標はfloat32で扱う
+            # (BlazePoseの出力は元々float32精度で、最終的にはint8に量子化する)
+            rows[:, :, 2:5].astype(np.float32),
+            rows[:, :, 5],
+            rows[:, 0, 6],
+        )
+
     def calc_torsodir(self) -> None:
         cur = self.cursor()
-        curL = self.cursor()
-        dir_data: list[
-            tuple[int, float, float, float, str, float, float, float, float]
-        ] = []
-        dir_vec_data: list[tuple[int, bytes, bytes, bytes]] = []
-        cur.execute("SELECT id FROM Pose")
-        while True:
-            ent = cur.fetchone()
-            if ent is None:
-                break
+        # まとめて読み込む結果は位置で参照するので、sqlite3.Rowではなくタプルで受け取る
+        cur.row_factory = None
+        pose_ids, pos, confidence, half_min = self._load_torso_landmarks(cur)
+        # 今回算出し直すポーズ (算出できなかったポーズも古いベクトルは削除する)
+        target_ids = pose_ids.tolist()
+
+        # 全ポーズ分の胴体の向きをまとめて算出
+        dir_v, method_idx = _calc_torso_dir(pos, confidence >= TH_PRESENCE)
+        valid = method_idx >= 0
+        # 向きを算出できなかったポーズ (古い結果は両方のテーブルから削除する)
+        invalid_ids = pose_ids[~valid].tolist()
+        pose_ids, dir_v, method_idx, half_min = (
+            pose_ids[valid],
+            dir_v[valid],
+            method_idx[valid],
+            half_min[valid],
+        )
 
-            pose_id: int = ent[0]
-            curL.execute(
-                """
-                    SELECT *
-                    FROM Landmark
-                    WHERE poseId=?
-                    ORDER BY landmarkIndex
-                """,
-                (pose_id,),
-            )
-            landmark: list = curL.fetchall()
-            assert (
-                len(landmark) == COCO_LANDMARK_LEN
-            ), f"Expected {COCO_LANDMARK_LEN} landmarks, but got {len(landmark)} for pose_id={pose_id}"
-            L.debug(f"pose_id={pose_id}")
+        # yaw_vecは、dir_vのx, z成分を抜き出して正規化したもの
+        # (norm_xzが0の場合はゼロベクトル)
+        xz = dir_v[:, [0, 2]]
+        norm_xz = _norm(xz)
+        yaw_vec = np.zeros_like(xz)
+        np.divide(xz, norm_xz[:, None], out=yaw_vec, where=norm_xz[:, None] > 0)
 
+        # pitch: XZ 平面に対する上下角
+        # np.arctan2(y, 水平方向の長さ) で求め、-π/2 ～ +π/2 を -1 ～ +1 に線形マッピング
+        pitch_norm = np.arctan2(dir_v[:, 1], norm_xz) / (np.pi / 2)
+        # 念のため範囲外をクリップ
+        pitch_norm = np.clip(pitch_norm, -1.0, 1.0)
+
+        if L.getLogger().isEnabledFor(L.DEBUG):
             # -- log ---
-            curL.execute(
-                """
-                SELECT File.path FROM File
-                    INNER JOIN Pose ON File.id = Pose.fileId
-                    WHERE Pose.id=?
-             """,
-                (pose_id,),
+            paths = dict(
+                cur.execute(
+                    """
+                    SELECT Pose.id, File.path FROM File
+                        INNER JOIN Pose ON File.id = Pose.fileId
+                    """
+                ).fetchall()
             )
-            L.debug(curL.fetchone()["path"])
+            for pose_id, m in zip(pose_ids.tolist(), method_idx.tolist()):
+                L.debug(f"pose_id={pose_id} {_TORSO_METHODS[m]} {paths[pose_id]}")
             # -- log end ---
 
-            lmLS, lmRS, lmLH, lmRH = (
-                landmark[CLm.left_shoulder.value],
-                landmark[CLm.right_shoulder.value],
-                landmark[CLm.left_hip.value],
-                landmark[CLm.right_hip.value],
-            )
-            assert lmLS["landmarkIndex"] == CLm.left_shoulder.value
-            assert lmRS["landmarkIndex"] == CLm.right_shoulder.value
-            assert lmLH["landmarkIndex"] == CLm.left_hip.value
-            assert lmRH["landmarkIndex"] == CLm.right_hip.value
-
-            posLS, posRS, posLH, posRH = (
-                np.array([lmLS["x"], lmLS["y"], lmLS["z"]]),
-                np.array([lmRS["x"], lmRS["y"], lmRS["z"]]),
-                np.array([lmLH["x"], lmLH["y"], lmLH["z"]]),
-                np.array([lmRH["x"], lmRH["y"], lmRH["z"]]),
+        # 結果を格納
+        # 数値の列は1つの配列に並べて一度にPythonの値へ変換し、
+        # 行のタプルは書き込み時に1件ずつ生成する (全行分のリストは作らない)
+        values = np.column_stack((dir_v, half_min, yaw_vec, pitch_norm)).tolist()
+        dir_data: Iterator[
+            tuple[int, float, float, float, str, float, float, float, float]
+        ] = (
+            (
+                pose_id,  # poseId
+                x,  # x
+                y,  # y
+                z,  # z
+                _TORSO_METHODS[m],  # method
+                score,  # score (とりあえずhalf_minをそのまま入力)
+                yaw_x,  # yaw_x
+                yaw_z,  # yaw_z
+                pitch,  # pitch
             )
-            TH_PRESENCE = 0.9
-            psLS, psRS, psLH, psRH = (
-                lmLS["confidence"] >= TH_PRESENCE,
-                lmRS["confidence"] >= TH_PRESENCE,
-                lmLH["confidence"] >= TH_PRESENCE,
-                lmRH["confidence"] >= TH_PRESENCE,
+            for pose_id, m, (x, y, z, score, yaw_x, yaw_z, pitch) in zip(
+                pose_ids.tolist(), method_idx.tolist(), values
             )
-
-            used_method: str = "invalid"
-
-            # 計算に使えるランドマークをカウント
-            # 胴体の向きを算出
-            def four_points() -> Optional[np.ndarray]:
-                nonlocal used_method
-                if psLS and psRS and psLH and psRH:
-                    used_method = "4pt: Both(Hip, Shoulder)"
-                    dir_vA = np.cross(posLH - posLS, posRS - posLS)
-                    dir_vA /= np.linalg.norm(dir_vA)
-                    dir_vB = np.cross(posLS - posRS, posRH - posRS)
-                    dir_vB /= np.linalg.norm(dir_vB)
-                    dir_v = dir_vA + dir_vB
-                    return dir_v / np.linalg.norm(dir_v)
-                return None
-
-            def three_points() -> Optional[np.ndarray]:
-                nonlocal used_method
-                dir_v = None
-                # 両方の肩と片方のヒップ
-                if psLS and psRS:
-                    if psLH:
-                        used_method = "3pt: (Both(Shoulder), LH))"
-                        dir_v = np.cross(posLH - posLS, posRS - posLS)
-                    elif psRH:
-                        used_method = "3pt: (Both(Shoulder), RH)"
-                        dir_v = np.cross(posLS - posRS, posRH - posRS)
-
-                if dir_v is None:
-                    # 両方のヒップと片方の肩
-                    if psLH and psRH:
-                        if psLS:
-                            used_method = "3pt: (LS, Both(Hip))"
-                            dir_v = -np.cross(posLS - posLH, posRH - posLH)
-                        elif psRS:
-                            used_method = "3pt: (RS, Both(Hip))"
-                            dir_v = np.cross(posRS - posRH, posLH - posRH)
-
-                if dir_v is not None:
-                    dir_v /= np.linalg.norm(dir_v)
-                    return dir_v
-                return None
-
-            def two_points() -> Optional[np.ndarray]:
-                nonlocal used_method
-                base_z = None
-                shoulder_to_hip = None
-                # 対角線
-                if psLS and psRH:
-                    base_z = np.array([0, 0, 1] if posLS[0] < posRH[0] else [0, 0, -1])
-                    shoulder_to_hip = posRH - posLS
-                    used_method = "2pt: (LS, RH)"
-                elif psLH and psRS:
-                    base_z = np.array([0, 0, 1] if posLH[0] < posRS[0] else [0, 0, -1])
-                    shoulder_to_hip = posLH - posRS
-                    used_method = "2pt: (LH, RS)"
-
-                if base_z is not None and shoulder_to_hip is not None:
-                    dir_v = np.cross(shoulder_to_hip, base_z)
-                    dir_v /= np.linalg.norm(dir_v)
-                    return dir_v
-                return None
-
-            dir_v_np: Optional[np.ndarray] = four_points()
-            if dir_v_np is None:
-                dir_v_np = three_points()
-                if dir_v_np is None:
-                    dir_v_np = two_points()
-
-            if dir_v_np is not None:
-                assert (
-                    len(dir_v_np) == 3
-                ), f"dir_v_np must be a numpy array of length 3, but got {len(dir_v_np)}"
-                # 姿勢検出の時の確かさの度合いを取得
-                curL.execute(
-                    "SELECT torsoHalfMin FROM Reliability WHERE poseId=?", (pose_id,)
-                )
-                half_min: float = curL.fetchone()[0]
-
-                # yaw_vecは、dir_v_npのx, z成分を抜き出して正規化したものを代入
-                xz = dir_v_np[[0, 2]]
-                norm_xz = np.linalg.norm(xz)
-                if norm_xz > 0:
-                    yaw_vec = (xz / norm_xz).tolist()
-                else:
-                    # norm_xzが0の場合のyaw_vecの初期化が不十分であることへの対応として
-                    # yaw_vecをゼロベクトルで初期化する。
-                    yaw_vec = [0.0, 0.0]
-
-                # pitch: XZ 平面に対する上下角
-                # np.arctan2(y, 水平方向の長さ) で求める
-                pitch_rad = float(np.arctan2(dir_v_np[1], norm_xz))
-                # -π/2 ～ +π/2 を -1 ～ +1 に線形マッピング
-                pitch_norm = float(pitch_rad / (np.pi / 2))
-                # 念のため範囲外をクリップ
-                pitch_norm = max(-1.0, min(1.0, pitch_norm))
-
-                # 結果を格納
-                dir_data.append(
-                    (
-                        pose_id,  # poseId
-                        dir_v_np[0],
-                        dir_v_np[1],
-                        dir_v_np[2],  # x,y,z
-                        used_method,  # method
-                        half_min,  # score (とりあえずhalf_minをそのまま入力)
-                        yaw_vec[0],  # yaw_x
-                        yaw_vec[1],  # yaw_z
-                        pitch_norm,  # pitch
-                    )
-                )
-                dir_vec_data.append(
-                    (
-                        pose_id,
-                        vec_serialize(dir_v_np.tolist()),
-                        vec_serialize(yaw_vec),
-                        vec_serialize([pitch_norm]),
-                    )
-                )
-
-        # dir_dataとdir_vec_dataのエントリ数が一致しない場合の例外処理の欠如への対応としてアサーション
-        assert (
-            len(dir_data) == len(dir_vec_data)
-        ), f"Length mismatch between dir_data ({len(dir_data)}) and dir_vec_data ({len(dir_vec_data)})"
-
-        # 既に存在するposeIdを削除
-        curL.execute(
-            """
-            DELETE FROM MasseTorsoDir
-            WHERE poseId IN (SELECT id FROM Pose)
-            """
         )
-        curL.execute(
-            """
-            DELETE FROM MasseTorsoVec
-            WHERE poseId IN (SELECT id FROM Pose)
-            """
-        )
-        # テーブルに書きこむ
-        curL.executemany(
-            "INSERT INTO MasseTorsoDir VALUES(?,?,?,?,?,?,?,?,?)", dir_data
+        # KNNサーチ用のベクトルは全件まとめて量子化する
+        dir_vec_data: Iterator[tuple[int, bytes, bytes, bytes]] = zip(
+            pose_ids.tolist(),
+            vec_serialize_int8_rows(dir_v),
+            vec_serialize_int8_rows(yaw_vec),
+            vec_serialize_int8_rows(pitch_norm[:, None]),
         )
 
-        # KNNサーチ用テーブルの書き込み
-        curL.executemany(
-            """
-            INSERT INTO MasseTorsoVec(poseId, dir, yaw, pitch)
-           VALUES(?,?,?,?)
-        """,
-            dir_vec_data,
-        )
+        with self.transaction():
+            # 算出できなくなったポーズの古い結果を削除する
+            cur.executemany(
+                "DELETE FROM MasseTorsoDir WHERE poseId = ?",
+                ((pose_id,) for pose_id in invalid_ids),
+            )
+            # テーブルに書きこむ (既に存在するposeIdは更新)
+            self.bulk_upsert(
+                "MasseTorsoDir",
+                (
+                    "poseId",
+                    "x",
+                    "y",
+                    "z",
+                    "method",
+                    "score",
+                    "yaw_x",
+                    "yaw_z",
+                    "pitch",
+                ),
+                dir_data,
+                ("poseId",),
+            )
+
+            # KNNサーチ用テーブルの書き込み
+            # vec0(仮想テーブル)はUPSERTに対応していないので、既存のposeIdを削除してから書き込む
+            # (poseIdは主キーなので、1件ずつの削除でも索引で引ける)
+            cur.executemany(
+                "DELETE FROM MasseTorsoVec WHERE poseId = ?",
+                ((pose_id,) for pose_id in target_ids),
+            )
+            cur.executemany(
+                """
+                INSERT INTO MasseTorsoVec(poseId, dir, yaw, pitch)
+                VALUES(?,vec_int8(?),vec_int8(?),vec_int8(?))
+                """,
+                dir_vec_data,
+            )
 
 
 def process(database_path: Path, init_db: bool) -> None:
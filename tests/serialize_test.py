@@ -0,0 +1,37 @@
+import numpy as np
+from src.common.serialize import (
+    INT8_SCALE,
+    vec_deserialize,
+    vec_deserialize_int8,
+    vec_serialize,
+    vec_serialize_int8,
+    vec_serialize_int8_rows,
+)
+
+
+def test_vec_serialize_deserialize():
+    test_vector = [1.0, 2.5, -3.14, 0.0, 100.5]
+    deserialized_vector = vec_deserialize(vec_serialize(test_vector))
+
+    # 元のベクトルとデシリアライズされたベクトルが(ほぼ)一致するか確認
+    assert len(deserialized_vector) == len(test_vector)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(test_vector, deserialized_vector))
+
+
+def test_vec_serialize_deserialize_int8():
+    test_vector = [1.0, -1.0, 0.5, 0.0, -0.25]
+    deserialized_vector = vec_deserialize_int8(vec_serialize_int8(test_vector))
+
+    # 量子化誤差の範囲で一致するか確認
+    assert len(deserialized_vector) == len(test_vector)
+    assert all(
+        abs(a - b) <= 0.5 / INT8_SCALE for a, b in zip(test_vector, deserialized_vector)
+    )
+
+
+def test_vec_serialize_int8_rows_matches_single():
+    # 行毎にvec_serialize_int8した場合と同じバイト列になるか
+    test_vectors = [[1.0, -1.0, 0.5], [0.0, -0.25, 2.0], [1 / 254, 3 / 254, -1.2]]
+    assert vec_serialize_int8_rows(np.array(test_vectors)) == [
+        vec_serialize_int8(v) for v in test_vectors
+    ]
@@ -1,5 +1,7 @@
 import builtins
 import os
+import shutil
+import subprocess
 import sys
 from pathlib import PurePosixPath, PureWindowsPath
 
@@ -9,6 +11,7 @@ from src.common.wsl import (
     WslVariant,
     _get_kernel_release,
     _manual_mnt_drive_convert,
+    _run_wslpath,
     _wsl_unc_fallback,
     get_wsl_variant,
     is_wsl_environment,
@@ -224,3 +227,35 @@ def test_manual_mnt_drive_convert_relative_path():
     # 相対パスは対象外
     p = PurePosixPath("mnt/c/Users/test")
     assert _manual_mnt_drive_convert(p) is None
+
+
+def test_run_wslpath_cached(monkeypatch):
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout="C:\\Users\\test\n")
+
+    monkeypatch.setattr(shutil, "which", lambda name: "/usr/bin/wslpath")
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    _run_wslpath.cache_clear()
+    assert _run_wslpath("/mnt/c/Users/test") == "C:\\Users\\test"
+    assert _run_wslpath("/mnt/c/Users/test") == "C:\\Users\\test"
+    # 2回目はキャッシュから返るのでサブプロセスは1回だけ
+    assert len(calls) == 1
+    _run_wslpath.cache_clear()
+
+
+def test_posix_to_windows_mnt_skips_wslpath(monkeypatch):
+    monkeypatch.setattr("src.common.wsl.is_wsl_environment", lambda: True)
+
+    def fail(p):
+        raise AssertionError("wslpath should not be called for /mnt/<drive>")
+
+    monkeypatch.setattr("src.common.wsl._run_wslpath", fail)
+    assert posix_to_windows(TEST_PATH) == "E:\\test_dir\\test.jpg"
+
+
+def test_manual_mnt_drive_convert_str_input():
+    # 文字列もそのまま受け付け、空要素や末尾の区切りは無視する
+    assert _manual_mnt_drive_convert("/mnt/c/Users//test/") == "C:\\Users\\test"